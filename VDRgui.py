@@ -6,24 +6,50 @@ Provides an easy-to-use interface for setting up NMEA data playback
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
-import subprocess
-import threading
+import queue
 import os
-import sys
+import time
+from collections import deque
 import socket
 import platform
 from pathlib import Path
 
+import VDRplayer
+
+# How often (ms) the GUI drains status from the player thread
+STATUS_POLL_INTERVAL = 100
+
+# Seconds a stopping player is given to finish before the GUI lets it go
+STOP_TIMEOUT = 5.0
+
+# Default number of lines kept in the output text area
+DEFAULT_LOG_LINES = 1000
+
+# Dashboard sparkline history length and client list refresh period (s)
+SPARKLINE_SAMPLES = 60
+CLIENT_LIST_INTERVAL = 1.0
+
 class VDRPlayerGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("VDRplayer - NMEA Data Player")
-        self.root.geometry("600x700")
+        self.root.geometry("650x950")
         self.root.resizable(True, True)
         
-        # Process tracking
-        self.vdr_process = None
+        # Player tracking; the player thread reports through status_queue
+        self.player = None
         self.is_running = False
+        self.stop_deadline = None   # time.monotonic() to give up waiting
+        self.closing = False
+        self.status_queue = queue.Queue()
+        self.last_rate_time = None
+        self.last_rate_sent = 0
+        self.last_rate_bytes = 0
+        self.last_client_update = 0.0
+        self.msg_rates = deque(maxlen=SPARKLINE_SAMPLES)
+        self.byte_rates = deque(maxlen=SPARKLINE_SAMPLES)
+        self.timeline_start = None
+        self.scrubbing = False
         
         # Create GUI elements
         self.create_widgets()
@@ -133,6 +159,13 @@ class VDRPlayerGUI:
         custom_args_entry.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(10, 0))
         advanced_frame.columnconfigure(1, weight=1)
         
+        # Output lines kept in the log view
+        ttk.Label(advanced_frame, text="Log lines kept:").grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+        self.log_lines_var = tk.StringVar(value=str(DEFAULT_LOG_LINES))
+        log_lines_spin = ttk.Spinbox(advanced_frame, from_=100, to=100000, increment=100, 
+                                    textvariable=self.log_lines_var, width=10)
+        log_lines_spin.grid(row=1, column=1, sticky=tk.W, padx=(10, 0), pady=(5, 0))
+        
         # Control Buttons Section
         button_frame = ttk.Frame(main_frame)
         button_frame.grid(row=5, column=0, columnspan=3, pady=(0, 10))
@@ -145,6 +178,10 @@ class VDRPlayerGUI:
                                      command=self.stop_vdrplayer, state=tk.DISABLED)
         self.stop_button.pack(side=tk.LEFT, padx=(0, 10))
         
+        self.pause_button = ttk.Button(button_frame, text="Pause", 
+                                      command=self.toggle_pause, state=tk.DISABLED)
+        self.pause_button.pack(side=tk.LEFT, padx=(0, 10))
+        
         ttk.Button(button_frame, text="Test Configuration", 
                   command=self.test_configuration).pack(side=tk.LEFT, padx=(0, 10))
         
@@ -154,12 +191,15 @@ class VDRPlayerGUI:
         ttk.Button(button_frame, text="Load Config", 
                   command=self.load_configuration).pack(side=tk.LEFT)
         
+        # Playback Dashboard Section
+        self.create_dashboard(main_frame)
+        
         # Status and Output Section
         output_frame = ttk.LabelFrame(main_frame, text="Status and Output", padding="10")
-        output_frame.grid(row=6, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
+        output_frame.grid(row=7, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
         output_frame.columnconfigure(0, weight=1)
-        output_frame.rowconfigure(1, weight=1)
-        main_frame.rowconfigure(6, weight=1)
+        output_frame.rowconfigure(2, weight=1)
+        main_frame.rowconfigure(7, weight=1)
         
         # Status bar
         self.status_var = tk.StringVar(value="Ready")
@@ -167,13 +207,64 @@ class VDRPlayerGUI:
                                 font=('Arial', 9), foreground='blue')
         status_label.grid(row=0, column=0, sticky=tk.W)
         
+        # Live counters
+        counters_frame = ttk.Frame(output_frame)
+        counters_frame.grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+        self.rate_var = tk.StringVar(value="-")
+        self.clients_var = tk.StringVar(value="-")
+        self.position_var = tk.StringVar(value="-")
+        for column, (label, var) in enumerate([("Rate:", self.rate_var),
+                                               ("Clients:", self.clients_var),
+                                               ("Position:", self.position_var)]):
+            ttk.Label(counters_frame, text=label).grid(row=0, column=2 * column, sticky=tk.W)
+            ttk.Label(counters_frame, textvariable=var, width=16).grid(row=0, column=2 * column + 1, 
+                                                                       sticky=tk.W, padx=(5, 10))
+        
         # Output text area
         self.output_text = scrolledtext.ScrolledText(output_frame, height=12, width=70)
-        self.output_text.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(5, 0))
+        self.output_text.grid(row=2, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(5, 0))
         
         # Clear output button
         ttk.Button(output_frame, text="Clear Output", 
-                  command=self.clear_output).grid(row=2, column=0, sticky=tk.E, pady=(5, 0))
+                  command=self.clear_output).grid(row=3, column=0, sticky=tk.E, pady=(5, 0))
+    
+    def create_dashboard(self, main_frame):
+        """Timeline scrubber, rate sparklines and TCP client list"""
+        dashboard_frame = ttk.LabelFrame(main_frame, text="Playback Dashboard", padding="10")
+        dashboard_frame.grid(row=6, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 10))
+        dashboard_frame.columnconfigure(1, weight=1)
+        
+        # Timeline slider, in seconds from the start of the recording
+        ttk.Label(dashboard_frame, text="Timeline:").grid(row=0, column=0, sticky=tk.W)
+        self.timeline_var = tk.DoubleVar(value=0.0)
+        self.timeline_scale = ttk.Scale(dashboard_frame, from_=0.0, to=1.0, orient=tk.HORIZONTAL,
+                                        variable=self.timeline_var, state=tk.DISABLED)
+        self.timeline_scale.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(10, 10))
+        self.timeline_scale.bind("<ButtonPress-1>", self.timeline_pressed)
+        self.timeline_scale.bind("<ButtonRelease-1>", self.timeline_released)
+        self.timeline_label_var = tk.StringVar(value="-")
+        ttk.Label(dashboard_frame, textvariable=self.timeline_label_var, width=18).grid(row=0, column=2, sticky=tk.W)
+        
+        # Sparklines
+        ttk.Label(dashboard_frame, text="Sentences/s:").grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+        self.msg_canvas = tk.Canvas(dashboard_frame, height=36, background='white', highlightthickness=0)
+        self.msg_canvas.grid(row=1, column=1, sticky=(tk.W, tk.E), padx=(10, 10), pady=(5, 0))
+        self.msg_rate_var = tk.StringVar(value="-")
+        ttk.Label(dashboard_frame, textvariable=self.msg_rate_var, width=18).grid(row=1, column=2, sticky=tk.W, pady=(5, 0))
+        
+        ttk.Label(dashboard_frame, text="Bytes/s:").grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
+        self.byte_canvas = tk.Canvas(dashboard_frame, height=36, background='white', highlightthickness=0)
+        self.byte_canvas.grid(row=2, column=1, sticky=(tk.W, tk.E), padx=(10, 10), pady=(5, 0))
+        self.byte_rate_var = tk.StringVar(value="-")
+        ttk.Label(dashboard_frame, textvariable=self.byte_rate_var, width=18).grid(row=2, column=2, sticky=tk.W, pady=(5, 0))
+        
+        # TCP clients and their queued output
+        self.client_tree = ttk.Treeview(dashboard_frame, columns=("client", "backlog"),
+                                        show="headings", height=4)
+        self.client_tree.heading("client", text="TCP client")
+        self.client_tree.heading("backlog", text="Backlog (bytes)")
+        self.client_tree.column("backlog", width=120, anchor=tk.E)
+        self.client_tree.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(5, 0))
     
     def load_defaults(self):
         """Load default values"""
@@ -341,7 +432,7 @@ class VDRPlayerGUI:
         return args
     
     def start_vdrplayer(self):
-        """Start VDRplayer process"""
+        """Start VDRplayer on a worker thread"""
         if self.is_running:
             messagebox.showwarning("Already Running", "VDRplayer is already running")
             return
@@ -353,76 +444,232 @@ class VDRPlayerGUI:
             return
         
         try:
-            # Build command
+            # Build the same arguments the command line version takes
             args = self.build_command_line()
+            options = VDRplayer.parseArgs(args[1:])
+            if options is None:
+                raise ValueError("--help is not supported from the GUI")
             
             # Update status
             self.status_var.set("Starting VDRplayer...")
-            self.log_output(f"Starting VDRplayer with command: python {' '.join(args)}")
+            self.log_output(f"Starting VDRplayer with arguments: {' '.join(args[1:])}")
             
-            # Start process
-            self.vdr_process = subprocess.Popen(
-                [sys.executable] + args,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                bufsize=1
-            )
+            self.reset_dashboard()
+            self.player = VDRplayer.Player(on_log=self.queue_log,
+                                           on_stats=self.queue_stats,
+                                           progressInterval=0.2,
+                                           **options)
+            VDRplayer.keep_alive.prevent_sleep(log=self.queue_log)
+            self.player.start()
             
             self.is_running = True
             self.start_button.configure(state=tk.DISABLED)
             self.stop_button.configure(state=tk.NORMAL)
+            self.pause_button.configure(state=tk.NORMAL, text="Pause")
             self.status_var.set("VDRplayer running...")
             
-            # Start thread to monitor output
-            threading.Thread(target=self.monitor_process, daemon=True).start()
+            # Start polling for status from the player thread
+            self.root.after(STATUS_POLL_INTERVAL, self.poll_player)
             
         except Exception as e:
             messagebox.showerror("Error", f"Failed to start VDRplayer: {str(e)}")
             self.status_var.set("Error starting VDRplayer")
     
     def stop_vdrplayer(self):
-        """Stop VDRplayer process"""
-        if self.vdr_process and self.is_running:
+        """Stop VDRplayer"""
+        if self.player and self.is_running:
             try:
-                self.vdr_process.terminate()
-                self.vdr_process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                self.vdr_process.kill()
-                self.vdr_process.wait()
+                self.player.stop()
             except Exception as e:
-                self.log_output(f"Error stopping process: {e}")
+                self.log_output(f"Error stopping player: {e}")
             
-            self.cleanup_process()
+            # poll_player() cleans up once the player thread has ended,
+            # so the Tk thread never blocks waiting for it
+            self.stop_deadline = time.monotonic() + STOP_TIMEOUT
+            self.stop_button.configure(state=tk.DISABLED)
+            self.pause_button.configure(state=tk.DISABLED)
+            self.status_var.set("Stopping VDRplayer...")
+    
+    def toggle_pause(self):
+        """Pause or resume playback"""
+        if not (self.player and self.is_running):
+            return
+        try:
+            if self.pause_button.cget("text") == "Pause":
+                self.player.pause()
+                self.pause_button.configure(text="Resume")
+            else:
+                self.player.resume()
+                self.pause_button.configure(text="Pause")
+        except ValueError as e:
+            self.log_output(f"Cannot change playback: {e}")
     
     def cleanup_process(self):
-        """Clean up after process ends"""
+        """Clean up after the player ends"""
+        if not self.is_running:
+            return
+        self.drain_status_queue()
+        VDRplayer.keep_alive.allow_sleep()
         self.is_running = False
-        self.vdr_process = None
+        self.player = None
+        self.stop_deadline = None
+        if self.closing:
+            self.root.destroy()
+            return
         self.start_button.configure(state=tk.NORMAL)
         self.stop_button.configure(state=tk.DISABLED)
+        self.pause_button.configure(state=tk.DISABLED, text="Pause")
         self.status_var.set("VDRplayer stopped")
-        self.log_output("VDRplayer process ended")
+        self.log_output("VDRplayer ended")
+    
+    def queue_log(self, message):
+        """Called on the player thread for every log message"""
+        self.status_queue.put(('log', message))
+    
+    def queue_stats(self, stats):
+        """Called on the player thread at most every progressInterval"""
+        self.status_queue.put(('stats', stats))
+    
+    def drain_status_queue(self):
+        """Apply everything the player thread has reported so far.
+        
+        Log lines are inserted as one batch and only the latest
+        statistics are shown, however many arrived since the last poll.
+        """
+        lines = []
+        stats = None
+        while True:
+            try:
+                kind, item = self.status_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'log':
+                lines.append(item)
+            else:
+                stats = item
+        if lines:
+            self.log_output("\n".join(lines))
+        if stats is not None:
+            self.show_stats(stats)
+    
+    def show_stats(self, stats):
+        """Show the latest player statistics in the status bar and counters"""
+        if stats['lines'] and stats['lines'] != float('inf'):
+            progress = f"line {stats['line']}/{stats['lines']} ({100.0 * stats['line'] / stats['lines']:.1f}%)"
+        else:
+            progress = f"line {stats['line']}"
+        self.status_var.set(f"VDRplayer {stats['state']}: {progress}, "
+                            f"{stats['sent']} sent")
+        
+        now = time.monotonic()
+        if self.last_rate_time is not None and now > self.last_rate_time:
+            elapsed = now - self.last_rate_time
+            rate = (stats['sent'] - self.last_rate_sent) / elapsed
+            byte_rate = (stats['bytes'] - self.last_rate_bytes) / elapsed
+            self.rate_var.set(f"{rate:.1f} msg/s")
+            self.msg_rate_var.set(f"{rate:.1f}")
+            self.byte_rate_var.set(f"{byte_rate:.0f}")
+            self.msg_rates.append(rate)
+            self.byte_rates.append(byte_rate)
+            self.draw_sparkline(self.msg_canvas, self.msg_rates)
+            self.draw_sparkline(self.byte_canvas, self.byte_rates)
+        self.last_rate_time = now
+        self.last_rate_sent = stats['sent']
+        self.last_rate_bytes = stats['bytes']
+        self.clients_var.set(str(stats['clients']) if self.protocol_var.get() == "TCP" else "-")
+        if stats['position'] is not None:
+            position = f"{VDRplayer.formatDuration(stats['position'])} / {VDRplayer.formatDuration(stats['span'])}"
+            self.position_var.set(position)
+            self.timeline_label_var.set(position)
+            self.timeline_start = stats['start']
+            if not self.scrubbing:
+                self.timeline_scale.configure(to=max(stats['span'], 1.0), state=tk.NORMAL)
+                self.timeline_var.set(stats['position'])
+        else:
+            self.position_var.set("-")
+        
+        if now - self.last_client_update >= CLIENT_LIST_INTERVAL and self.player is not None:
+            self.last_client_update = now
+            self.update_client_list(self.player.clientList())
+    
+    def reset_dashboard(self):
+        """Clear the dashboard for a new run"""
+        self.last_rate_time = None
+        self.last_client_update = 0.0
+        self.msg_rates.clear()
+        self.byte_rates.clear()
+        self.timeline_start = None
+        self.scrubbing = False
+        self.timeline_var.set(0.0)
+        self.timeline_scale.configure(state=tk.DISABLED)
+        self.timeline_label_var.set("-")
+        for canvas in (self.msg_canvas, self.byte_canvas):
+            canvas.delete("all")
+        self.update_client_list([])
+    
+    def draw_sparkline(self, canvas, samples):
+        """Draw samples as a line scaled to the canvas"""
+        canvas.delete("all")
+        if len(samples) < 2:
+            return
+        width = max(canvas.winfo_width(), 2)
+        height = max(canvas.winfo_height(), 2)
+        peak = max(samples) or 1.0
+        step = (width - 1) / (SPARKLINE_SAMPLES - 1)
+        x0 = width - 1 - step * (len(samples) - 1)
+        points = []
+        for i, value in enumerate(samples):
+            points.extend((x0 + i * step, height - 2 - (height - 4) * value / peak))
+        canvas.create_line(*points, fill='blue')
+    
+    def update_client_list(self, clients):
+        """Show TCP clients and their backlog; None means no update"""
+        if clients is None:
+            return
+        self.client_tree.delete(*self.client_tree.get_children())
+        for addr, backlog in clients:
+            self.client_tree.insert("", tk.END, values=(f"{addr[0]}:{addr[1]}", backlog))
     
-    def monitor_process(self):
-        """Monitor VDRplayer output in background thread"""
+    def timeline_pressed(self, event):
+        """Stop following playback while the slider is dragged"""
+        self.scrubbing = True
+    
+    def timeline_released(self, event):
+        """Seek to the slider position"""
+        self.scrubbing = False
+        if not (self.player and self.is_running) or self.timeline_start is None:
+            return
         try:
-            while self.is_running and self.vdr_process:
-                line = self.vdr_process.stdout.readline()
-                if line:
-                    # Update UI from background thread
-                    self.root.after(0, self.log_output, line.rstrip())
-                elif self.vdr_process.poll() is not None:
-                    break
-        except Exception as e:
-            self.root.after(0, self.log_output, f"Error monitoring process: {e}")
-        finally:
-            if self.vdr_process and self.vdr_process.poll() is not None:
-                self.root.after(0, self.cleanup_process)
+            self.player.seek(self.timeline_start + self.timeline_var.get())
+            self.log_output(f"Seeking to {VDRplayer.formatDuration(self.timeline_var.get())}")
+        except ValueError as e:
+            self.log_output(f"Cannot seek: {e}")
+    
+    def poll_player(self):
+        """Drain the status queue on the Tk thread"""
+        if not self.is_running or self.player is None:
+            return
+        self.drain_status_queue()
+        if self.player.running() and (self.stop_deadline is None or
+                                      time.monotonic() < self.stop_deadline):
+            self.root.after(STATUS_POLL_INTERVAL, self.poll_player)
+        else:
+            self.cleanup_process()
+    
+    def log_lines_limit(self):
+        """Number of lines the output text area keeps"""
+        try:
+            return max(1, int(self.log_lines_var.get()))
+        except ValueError:
+            return DEFAULT_LOG_LINES
     
     def log_output(self, message):
-        """Add message to output text area"""
+        """Add message to output text area, dropping the oldest lines
+        beyond the configured limit"""
         self.output_text.insert(tk.END, message + "\n")
+        excess = int(self.output_text.index('end-1c').split('.')[0]) - 1 - self.log_lines_limit()
+        if excess > 0:
+            self.output_text.delete('1.0', f"{excess + 1}.0")
         self.output_text.see(tk.END)
     
     def clear_output(self):
@@ -446,7 +693,8 @@ class VDRPlayerGUI:
                     'sleep_delay': self.sleep_var.get(),
                     'speed_factor': self.speed_var.get(),
                     'repeat_count': self.repeat_var.get(),
-                    'custom_args': self.custom_args_var.get()
+                    'custom_args': self.custom_args_var.get(),
+                    'log_lines': self.log_lines_var.get()
                 }
                 
                 with open(filename, 'w') as f:
@@ -490,6 +738,8 @@ class VDRPlayerGUI:
                     self.repeat_var.set(config['repeat_count'])
                 if 'custom_args' in config:
                     self.custom_args_var.set(config['custom_args'])
+                if 'log_lines' in config:
+                    self.log_lines_var.set(config['log_lines'])
                 
                 self.protocol_changed()  # Update UI
                 messagebox.showinfo("Success", f"Configuration loaded from {filename}")
@@ -500,8 +750,8 @@ class VDRPlayerGUI:
         """Handle application closing"""
         if self.is_running:
             if messagebox.askokcancel("Quit", "VDRplayer is still running. Stop it and quit?"):
+                self.closing = True
                 self.stop_vdrplayer()
-                self.root.after(1000, self.root.destroy)  # Give time to clean up
         else:
             self.root.destroy()
 
@@ -12,445 +12,3998 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
+import os
 import socket
+import select
 import selectors
 import types
 import time
 import getopt
 import platform
+import threading
+import bisect
+import collections
+import itertools
+import csv
+import datetime
+import re
+import json
+import hmac
+import hashlib
+import mmap
+import struct
+import stat
+from array import array
+
+# Platform modules for preventing system sleep (ctypes, subprocess) and
+# NumPy are imported when first needed, keeping them out of the startup
+# time of a replay.
+numpy = None
+
+# When this module was imported, by time.perf_counter(); the start of the
+# program when the process launch time is not known
+IMPORTED = time.perf_counter()
+
+
+# The time.perf_counter() value at which this process was launched.  Linux
+# gives the start time in clock ticks since boot; elsewhere the time the
+# module was imported is used.
+def processStart():
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return min(time.perf_counter() - age, IMPORTED)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return IMPORTED
+# End processStart()
 
-# Platform-specific imports for preventing system sleep
-try:
-    if platform.system() == 'Windows':
-        import ctypes
-        from ctypes import wintypes
-    elif platform.system() == 'Darwin':  # macOS
-        import subprocess
-    elif platform.system() == 'Linux':
-        import subprocess
-except ImportError:
-    pass
+
+# NumPy is optional; --analyze uses it to vectorise the per-line work
+def loadNumpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+    return numpy or None
 
 assert sys.version_info >= (3, 5), "Must run in Python version 3.5 or above"
 
 # Sleep interval (seconds) for TCP client connection polling
 TCP_CLIENT_POLL_INTERVAL = 0.1
 
-initialdelta = None
-starttime = None
+# Connections the system may hold for the TCP server before it accepts
+# them (capped by the system, e.g. net.core.somaxconn on Linux)
+TCP_LISTEN_BACKLOG = socket.SOMAXCONN
+
+# Most messages gathered into one scheduling tick, and most buffers handed
+# to a single sendmsg() call (the usual IOV_MAX)
+MAX_BATCH_MESSAGES = 1024
+MAX_SEND_BUFFERS = 1024
+
+# Seconds between reminders while a serial link stays saturated
+SERIAL_REPORT_INTERVAL = 10.0
+
+# Seconds between writes of the --checkpoint file, and how late a message
+# may be after --resume before it counts as missed while stopped
+CHECKPOINT_INTERVAL = 10.0
+CATCH_UP_TOLERANCE = 1.0
+CHECKPOINT_VERSION = 1
+
+# Coordinated playback (--coordinate, --worker): seconds between progress
+# reports from a worker and progress lines on the coordinator, how long a
+# worker may take to answer, and how far ahead the common start is set
+# once every worker is ready.  Each worker clock is probed CLOCK_PROBES
+# times and the answer with the shortest round trip gives its offset.
+WORKER_STATS_INTERVAL = 1.0
+COORDINATOR_REPORT = 5.0
+COORDINATOR_TIMEOUT = 10.0
+COORDINATOR_LEAD = 2.0
+CLOCK_PROBES = 5
+WORKER_MAX_LINE = 65536     # Longest command a worker accepts, in bytes
+
+# Most sentences a rate limit keeps waiting before it drops any more
+SHAPER_QUEUE_LIMIT = 10000
+
+# Shortest and longest intervals (seconds) between checks of a followed
+# file when inotify is not available
+FOLLOW_MIN_POLL = 0.01
+FOLLOW_MAX_POLL = 0.5
+
+# Bytes read from the start of the input to detect its format
+SNIFF_SIZE = 4096
+
+# Bytes gathered before each write of --output
+OUTPUT_CHUNK = 1024 * 1024
+
+# Shared memory ring layout.  The header holds the magic, version, data
+# capacity, the number of sentences published (seq) and the total bytes
+# published (head), the writer state and the time the writer started.
+# Each sentence is stored as a 4 byte length and its bytes, padded to 4
+# bytes; a length of RING_WRAP marks the unused end of the data area.
+RING_MAGIC = b'VDRR'
+RING_VERSION = 1
+RING_HEADER = 64
+RING_SEQ = 16               # Offset of seq and head, written together
+RING_STATE = 32
+RING_OPEN = 1
+RING_CLOSED = 2
+RING_WRAP = 0xFFFFFFFF
+RING_SIZE = 1024 * 1024     # Default data capacity in bytes
+RING_POLL = 0.001           # Seconds between checks of a waiting reader
+_ringHeader = struct.Struct('<4sIQQQII')
+_ringSeq = struct.Struct('<QQ')
+_ringLength = struct.Struct('<I')
 
 class SystemKeepAlive:
-    """Cross-platform system keep-alive to prevent sleep during execution"""
+    """Cross-platform system keep-alive to prevent sleep during execution.
+
+    On Linux and macOS the inhibitor is a child process that lives for the
+    rest of the session, so prevent_sleep() returns at once.  The child
+    exits by itself if VDRplayer dies without calling allow_sleep().  On
+    Linux whether the inhibitor works is only known later, and it is
+    reported through log from a background thread.
+    """
     
     def __init__(self):
         self.system = platform.system()
         self.caffeinate_process = None
+        self.inhibit_process = None
         self.active = False
+        self.log = print
     
-    def prevent_sleep(self):
+    def prevent_sleep(self, log=print):
         """Prevent system from sleeping - cross-platform"""
+        self.log = log
         try:
             if self.system == 'Windows':
                 # Windows: Use SetThreadExecutionState
+                import ctypes
                 ctypes.windll.kernel32.SetThreadExecutionState(
                     0x80000000 |  # ES_CONTINUOUS
                     0x00000002 |  # ES_SYSTEM_REQUIRED
                     0x00000001     # ES_DISPLAY_REQUIRED
                 )
                 self.active = True
-                print("Windows sleep prevention activated")
+                self.log("Windows sleep prevention activated")
                 
             elif self.system == 'Darwin':
-                # macOS: Use caffeinate command
-                self.caffeinate_process = subprocess.Popen(['caffeinate', '-d'])
+                # macOS: Use caffeinate command, which also exits with us
+                import subprocess
+                self.caffeinate_process = subprocess.Popen(
+                    ['caffeinate', '-d', '-w', str(os.getpid())])
                 self.active = True
-                print("macOS sleep prevention activated (caffeinate)")
+                self.log("macOS sleep prevention activated (caffeinate)")
                 
             elif self.system == 'Linux':
                 # Linux: Try to use systemd-inhibit or xset
+                import subprocess
                 try:
-                    # Try systemd-inhibit first (more modern)
-                    subprocess.run(['systemd-inhibit', '--what=idle:sleep', '--who=VDRplayer', 
-                                  '--why="NMEA data streaming"', '--mode=block', 'sleep', '1'], 
-                                 check=True, capture_output=True)
-                    print("Linux sleep prevention activated (systemd)")
-                    self.active = True
-                except (subprocess.CalledProcessError, FileNotFoundError):
-                    try:
-                        # Fallback to xset (X11 systems)
-                        subprocess.run(['xset', 's', 'off'], check=True, capture_output=True)
-                        subprocess.run(['xset', '-dpms'], check=True, capture_output=True)
-                        print("Linux sleep prevention activated (xset)")
-                        self.active = True
-                    except (subprocess.CalledProcessError, FileNotFoundError):
-                        print("Linux sleep prevention not available")
+                    # Try systemd-inhibit first (more modern).  It holds the
+                    # lock while cat runs, and cat exits when its stdin, a
+                    # pipe from this process, is closed.  The shell only
+                    # runs, and says so, once the lock has been taken.
+                    self.inhibit_process = subprocess.Popen(
+                        ['systemd-inhibit', '--what=idle:sleep',
+                         '--who=VDRplayer', '--why=NMEA data streaming',
+                         '--mode=block', 'sh', '-c', 'echo; exec cat'],
+                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                        stderr=subprocess.DEVNULL)
+                    threading.Thread(target=self._watch_inhibit,
+                                     args=(self.inhibit_process,),
+                                     daemon=True).start()
+                except OSError:
+                    threading.Thread(target=self._xset_off,
+                                     daemon=True).start()
                         
         except Exception as e:
-            print(f"Could not activate sleep prevention: {e}")
+            self.log(f"Could not activate sleep prevention: {e}")
+            self.active = False
+
+    def _watch_inhibit(self, process):
+        # systemd-inhibit fails quickly without a system bus; fall back to
+        # xset if it exits before taking the lock.  The line written once
+        # the lock is held means it works.
+        if process.stdout.readline():
+            if self.inhibit_process is process:
+                self.active = True
+                self.log("Linux sleep prevention activated (systemd)")
+        elif process.wait() != 0 and self.inhibit_process is process:
+            self.inhibit_process = None
+            self._xset_off()
+
+    def _xset_off(self):
+        import subprocess
+        try:
+            # Fallback to xset (X11 systems)
+            subprocess.run(['xset', 's', 'off'], check=True, capture_output=True)
+            subprocess.run(['xset', '-dpms'], check=True, capture_output=True)
+            self.active = True
+            self.log("Linux sleep prevention activated (xset)")
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            self.log("Linux sleep prevention not available")
             self.active = False
     
     def allow_sleep(self):
         """Allow system to sleep again - cross-platform"""
         try:
             if self.system == 'Windows' and self.active:
+                import ctypes
                 ctypes.windll.kernel32.SetThreadExecutionState(0x80000000)  # ES_CONTINUOUS
-                print("Windows sleep prevention deactivated")
+                self.log("Windows sleep prevention deactivated")
                 
             elif self.system == 'Darwin' and self.caffeinate_process:
                 self.caffeinate_process.terminate()
                 self.caffeinate_process.wait()
-                print("macOS sleep prevention deactivated")
+                self.log("macOS sleep prevention deactivated")
                 
+            elif self.system == 'Linux' and self.inhibit_process:
+                process = self.inhibit_process
+                self.inhibit_process = None
+                process.stdin.close()   # Ends cat and releases the lock
+                process.wait()
+                if self.active:
+                    self.log("Linux sleep prevention deactivated")
+
             elif self.system == 'Linux' and self.active:
+                import subprocess
                 try:
                     # Re-enable screen saver and power management
                     subprocess.run(['xset', 's', 'on'], capture_output=True)
                     subprocess.run(['xset', '+dpms'], capture_output=True)
-                    print("Linux sleep prevention deactivated")
+                    self.log("Linux sleep prevention deactivated")
                 except (subprocess.CalledProcessError, FileNotFoundError):
                     pass
                     
         except Exception as e:
-            print(f"Could not deactivate sleep prevention: {e}")
+            self.log(f"Could not deactivate sleep prevention: {e}")
         finally:
             self.active = False
             self.caffeinate_process = None
+            self.inhibit_process = None
+
+# Global keep-alive instance
+keep_alive = SystemKeepAlive()
+
+class percentComplete:
+
+    def __init__(self, tInc):
+        self.oldTime = time.perf_counter()
+        self.tInc = tInc
+
+    # Overwrites the line on the console, or goes to log if one is given
+    def printPercent(self, percent, log=None):
+        newTime = time.perf_counter()
+        if (newTime - self.oldTime) > self.tInc:
+            message = " %3.1f percent complete...." % round(percent, 1)
+            if log is None:
+                print(message, end='\r')
+            else:
+                log(message)
+            self.oldTime = newTime
+
+
+# Extract the NMEAv4 tag block time (c: parameter, UNIX seconds) from
+# a message such as \s:VDR,c:1437384131*5B\$GPRMC,...
+# Returns None when the message carries no timestamp.
+def getTimestamp(mess):
+    if mess[:1] != b"\\":
+        return None
+    end = mess.find(b"*")
+    if end < 0:
+        end = mess.find(b"\\", 1)
+        if end < 0:
+            return None
+    for field in mess[1:end].split(b","):
+        if field[:2] == b"c:":
+            try:
+                ts = float(field[2:])
+            except ValueError:
+                return None
+            if ts > 1e11:
+                ts /= 1000.0    # Some loggers write milliseconds
+            return ts
+    return None
+# End getTimestamp()
+
+
+def nmeaChecksum(data):
+    checksum = 0
+    for c in data:
+        checksum ^= c
+    return checksum
+
+
+# Give a message a tag block with c: time ts, replacing the time of any tag
+# block it has and keeping its other fields.  Whole seconds are written as
+# seconds and other times as milliseconds, as getTimestamp() reads them.
+# Times too small to be told apart from seconds that way (a time of day
+# without a date) are written as decimal seconds.
+def tagMessage(mess, ts):
+    fields = []
+    if mess[:1] == b"\\":
+        end = mess.find(b"\\", 1)
+        if end > 0:
+            body = mess[1:end]
+            star = body.rfind(b"*")
+            if star >= 0:
+                body = body[:star]
+            fields = [field for field in body.split(b",")
+                      if field and field[:2] != b"c:"]
+            mess = mess[end + 1:]
+    # End if
+    ms = int(round(ts * 1000))
+    if ms % 1000 == 0:
+        fields.append(b"c:%d" % (ms // 1000))
+    elif ms > 1e11:
+        fields.append(b"c:%d" % ms)
+    else:
+        fields.append(b"c:%.3f" % ts)
+    body = b",".join(fields)
+    return b"\\%s*%02X\\%s" % (body, nmeaChecksum(body), mess)
+# End tagMessage()
+
+
+class GapPolicy:
+    """How gaps between consecutive timestamps are replayed.
+
+    A gap is any step in recording time longer than threshold seconds.
+    'skip' replays gaps instantly, 'clamp' replays them as threshold
+    seconds, 'speed:F' replays them F times faster than the rest of the
+    recording and 'real' replays them unchanged.
+    """
+
+    MODES = ('skip', 'clamp', 'speed', 'real')
+
+    def __init__(self, mode='skip', threshold=60.0, factor=1.0):
+        if mode not in self.MODES:
+            raise ValueError("Unknown gap policy '%s'" % mode)
+        if threshold < 0:
+            raise ValueError("Gap threshold must be non-negative")
+        if factor <= 0:
+            raise ValueError("Gap speed factor must be positive")
+        self.mode = mode
+        self.threshold = threshold
+        self.factor = factor
+
+    @classmethod
+    def parse(cls, spec, threshold=60.0):
+        mode, _, arg = spec.partition(':')
+        mode = mode.lower()
+        if mode == 'speed':
+            try:
+                factor = float(arg)
+            except ValueError:
+                raise ValueError("Gap policy 'speed' needs a factor, "
+                                 "e.g. --gap=speed:60")
+            return cls(mode, threshold, factor)
+        if arg:
+            raise ValueError("Gap policy '%s' takes no argument" % mode)
+        return cls(mode, threshold)
+
+    def compress(self, dt):
+        """Return the recording-time seconds a step of dt is replayed as"""
+        if dt <= 0:
+            return 0.0
+        if dt <= self.threshold or self.mode == 'real':
+            return dt
+        if self.mode == 'skip':
+            return 0.0
+        if self.mode == 'clamp':
+            return self.threshold
+        return dt / self.factor
+
+    def __str__(self):
+        if self.mode == 'speed':
+            return "speed:%g above %gs" % (self.factor, self.threshold)
+        if self.mode == 'real':
+            return "real"
+        return "%s above %gs" % (self.mode, self.threshold)
+# End GapPolicy
+
+
+class TimestampIndex:
+    """Byte offset, recording time and compressed replay time of every
+    timestamped line in a file, built in the same pass that counts lines.
+
+    The index may be built on another thread while it is in use; done is
+    set once it is complete.  Until then lines is 0 and find() only knows
+    the part of the file read so far.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.lines = 0
+        self.offsets = array('q')
+        self.linenos = array('q')
+        self.stamps = array('d')
+        self.vtimes = array('d')
+        self.done = threading.Event()
+
+    def add(self, offset, lineno, ts):
+        if self.stamps:
+            vt = self.vtimes[-1] + self.policy.compress(ts - self.stamps[-1])
+        else:
+            vt = 0.0
+        self.offsets.append(offset)
+        self.linenos.append(lineno)
+        self.vtimes.append(vt)
+        self.stamps.append(ts)  # Last, as find() searches the stamps
+
+    def __len__(self):
+        return len(self.stamps)
+
+    def span(self):
+        """Return (recording seconds, compressed replay seconds at 1x)"""
+        if not self.stamps:
+            return (0.0, 0.0)
+        return (self.stamps[-1] - self.stamps[0], self.vtimes[-1])
+
+    def find(self, ts):
+        """Return the entry of the first message at or after recording
+        time ts, assuming timestamps increase through the file"""
+        i = bisect.bisect_left(self.stamps, ts)
+        return min(i, len(self.stamps) - 1)
+# End TimestampIndex
+
+
+# Count the lines in a file and index its timestamps in a single pass.
+# An AisSelection, if given, is built in the same pass.  An existing,
+# empty index may be passed in to be filled, e.g. from another thread.
+# Files in other formats than NMEA lines are read with a fresh decoder.
+def indexFile(f, policy, selection=None, index=None, decoder=None):
+    if index is None:
+        index = TimestampIndex(policy)
+    offset = 0
+    n = 0
+    for line in f:
+        if decoder is not None:
+            ts = decoder.decode(line)[0]
+            if ts is not None:
+                index.add(offset, n, ts)
+        elif line[:1] == b"\\":
+            ts = getTimestamp(line)
+            if ts is not None:
+                index.add(offset, n, ts)
+        if selection is not None:
+            selection.add(offset, line)
+        offset += len(line)
+        n += 1
+    f.seek(0)
+    index.lines = n
+    if selection is not None:
+        selection.finish()
+    index.done.set()
+    return index
+# End indexFile()
+
+
+# Index fName on a daemon thread with a file handle of its own, calling
+# onDone() when the index is complete.  An AisSelection is built in the
+# same pass and is finished even if reading fails, so that a
+# SelectiveReader waiting for it is released.
+def indexInBackground(fName, index, onDone=None, decoder=None,
+                      selection=None):
+    def run():
+        try:
+            with open(fName, 'rb') as f:
+                indexFile(f, index.policy, selection, index, decoder)
+        finally:
+            if selection is not None:
+                selection.finish()
+        if onDone is not None:
+            onDone()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+# End indexInBackground()
+
+
+# AIS payload decoding for selective replay.  Only the MMSI and, where the
+# message type has one, the position are decoded.
+
+# Bit offsets of (longitude, latitude, field width, units per degree) for
+# the AIS message types that report a position
+AIS_POSITION_FIELDS = {
+    1: (61, 89, 28, 600000.0), 2: (61, 89, 28, 600000.0),
+    3: (61, 89, 28, 600000.0), 4: (79, 107, 28, 600000.0),
+    9: (61, 89, 28, 600000.0), 11: (79, 107, 28, 600000.0),
+    18: (57, 85, 28, 600000.0), 19: (57, 85, 28, 600000.0),
+    21: (164, 192, 28, 600000.0), 27: (44, 62, 18, 600.0),
+}
+
+
+# Turn an armoured AIS payload into (integer of all bits, bit count)
+def aisBits(payload):
+    value = 0
+    for c in payload:
+        c -= 48
+        if c > 40:
+            c -= 8
+        value = (value << 6) | (c & 0x3f)
+    return (value, 6 * len(payload))
+
+
+def aisField(bits, start, length, signed=False):
+    (value, nbits) = bits
+    if start + length > nbits:
+        return None
+    field = (value >> (nbits - start - length)) & ((1 << length) - 1)
+    if signed and field >> (length - 1):
+        field -= 1 << length
+    return field
+
+
+# Return (MMSI, latitude, longitude) of an AIS payload; the position is
+# None for message types without one or when it is not available.
+def decodeAis(payload):
+    bits = aisBits(payload)
+    msgType = aisField(bits, 0, 6)
+    mmsi = aisField(bits, 8, 30)
+    if mmsi is None:
+        return None
+    position = None
+    fields = AIS_POSITION_FIELDS.get(msgType)
+    if fields is not None:
+        (lonStart, latStart, width, scale) = fields
+        lon = aisField(bits, lonStart, width, True)
+        lat = aisField(bits, latStart, width - 1, True)
+        if lon is not None and lat is not None:
+            (lat, lon) = (lat / scale, lon / scale)
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                position = (lat, lon)
+    return (mmsi, position)
+# End decodeAis()
+
+
+class AisFilter:
+    """Which AIS messages a selective replay keeps.
+
+    A message is kept when its MMSI is in mmsis (if given) and, when a
+    bounding box (minLat, minLon, maxLat, maxLon) is given, it reports a
+    position inside the box, or it carries no position and the vessel
+    has already reported one inside the box.
+    """
+
+    def __init__(self, mmsis=None, bbox=None):
+        self.mmsis = set(mmsis) if mmsis else None
+        self.bbox = bbox
+        self.inside = set()
+
+    @classmethod
+    def parse(cls, mmsiSpec=None, bboxSpec=None):
+        mmsis = None
+        bbox = None
+        if mmsiSpec:
+            mmsis = [int(m) for m in mmsiSpec.split(',') if m.strip()]
+        if bboxSpec:
+            bbox = [float(v) for v in bboxSpec.split(',')]
+            if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+                raise ValueError("--bbox needs minLat,minLon,maxLat,maxLon")
+        return cls(mmsis, bbox)
+
+    def keep(self, mmsi, position):
+        if self.mmsis is not None and mmsi not in self.mmsis:
+            return False
+        if self.bbox is None:
+            return True
+        if position is None:
+            return mmsi in self.inside
+        (lat, lon) = position
+        if self.bbox[0] <= lat <= self.bbox[2] and \
+                self.bbox[1] <= lon <= self.bbox[3]:
+            self.inside.add(mmsi)
+            return True
+        return False
+# End AisFilter
+
+
+class AisSelection:
+    """Byte ranges of a file that a selective AIS replay plays.
+
+    Built line by line with add(); non-AIS lines are always kept and all
+    fragments of a multi-sentence AIS message are kept or skipped
+    together.  Adjacent kept lines are merged into one range, and the
+    file line number each range starts at is kept with it.  Only these
+    ranges are stored, not the decoded messages.  Ranges are published
+    under cond, so that a SelectiveReader can play them while the rest
+    of the file is still being read; done is set by finish().
+    """
+
+    MAX_PENDING = 1000      # Lines held back waiting for missing fragments
+
+    def __init__(self, aisFilter):
+        self.aisFilter = aisFilter
+        self.starts = array('q')
+        self.ends = array('q')
+        self.firstLines = array('q')    # File line number of each start
+        self.lines = 0          # Lines kept
+        self.total = 0          # Lines read
+        self.aisKept = 0
+        self.aisTotal = 0
+        self.pending = collections.deque()  # [offset, length, decision, n]
+        self.groups = {}        # (sequence id, channel) -> [payload, lines]
+        self.cond = threading.Condition()
+        self.done = threading.Event()
+
+    def add(self, offset, line):
+        entry = [offset, len(line), True, self.total]
+        self.total += 1
+        self.pending.append(entry)
+        start = line.find(b"!")
+        if start >= 0 and line[start + 3:start + 6] in (b"VDM", b"VDO"):
+            self._addAis(entry, line[start:].split(b"*")[0].split(b","))
+        self._flush()
+
+    def _addAis(self, entry, fields):
+        if len(fields) < 6:
+            entry[2] = False
+            return
+        try:
+            (count, number) = (int(fields[1]), int(fields[2]))
+        except ValueError:
+            entry[2] = False
+            return
+        if count <= 1:
+            self._decide([entry], fields[5])
+            return
+        key = (fields[3], fields[4])
+        if number == 1 or key not in self.groups:
+            if key in self.groups:
+                self._decide(self.groups[key][1], None)
+            self.groups[key] = [b"", []]
+        group = self.groups[key]
+        group[0] += fields[5]
+        group[1].append(entry)
+        entry[2] = None
+        if number >= count:
+            del self.groups[key]
+            self._decide(group[1], group[0])
+
+    def _decide(self, entries, payload):
+        self.aisTotal += 1
+        decoded = decodeAis(payload) if payload else None
+        keep = decoded is not None and self.aisFilter.keep(*decoded)
+        if keep:
+            self.aisKept += 1
+        for entry in entries:
+            entry[2] = keep
+
+    def _flush(self, final=False):
+        pending = self.pending
+        if not (pending and (pending[0][2] is not None or final or
+                             len(pending) > self.MAX_PENDING)):
+            return
+        with self.cond:
+            while pending and (pending[0][2] is not None or final or
+                               len(pending) > self.MAX_PENDING):
+                (offset, length, keep, n) = pending.popleft()
+                if not keep:
+                    continue
+                self.lines += 1
+                if self.ends and self.ends[-1] == offset:
+                    self.ends[-1] = offset + length
+                else:
+                    self.starts.append(offset)
+                    self.ends.append(offset + length)
+                    self.firstLines.append(n)
+            self.cond.notify_all()
+
+    def finish(self):
+        if self.done.is_set():
+            return
+        for (payload, entries) in self.groups.values():
+            for entry in entries:
+                entry[2] = False
+        self.groups = {}
+        self._flush(final=True)
+        with self.cond:
+            self.done.set()
+            self.cond.notify_all()
+
+    def summary(self):
+        return ("AIS filter keeps %d of %d AIS messages, %d of %d lines." %
+                (self.aisKept, self.aisTotal, self.lines, self.total))
+# End AisSelection
+
+
+class Partition:
+    """Share of a recording played by part number of parts (--partition).
+
+    Messages are dealt out in turn, so that the parts together play every
+    message once.  All fragments of a multi-sentence AIS message count as
+    one message and go to the same part.
+    """
+
+    def __init__(self, number, parts):
+        if not (1 <= number <= parts):
+            raise ValueError("Partition must be I/N with 1 <= I <= N")
+        self.number = number
+        self.parts = parts
+        self.count = 0
+        self.groups = {}        # (sequence id, channel) -> keep
+
+    def keep(self, mess):
+        key = None
+        start = mess.find(b"!")
+        if start >= 0 and mess[start + 3:start + 6] in (b"VDM", b"VDO"):
+            fields = mess[start:].split(b",", 5)
+            if len(fields) == 6 and fields[1] not in (b"0", b"1"):
+                key = (fields[3], fields[4])
+                if fields[2] != b"1" and key in self.groups:
+                    return self.groups[key]
+        # End if
+        self.count += 1
+        keep = self.count % self.parts == self.number % self.parts
+        if key is not None:
+            self.groups[key] = keep
+        return keep
+
+    def __str__(self):
+        return "%d/%d" % (self.number, self.parts)
+# End Partition
+
+
+class SelectiveReader:
+    """Read only the selected byte ranges of a binary file.
+
+    The AisSelection may still be being built on another thread; readline()
+    then waits for the next range.  lineno is the file line number of the
+    next line to read, so that skipped lines are counted as in the
+    TimestampIndex.
+    """
+
+    def __init__(self, f, selection):
+        self.f = f
+        self.selection = selection
+        self.seek(0)
+
+    def seek(self, offset, lineno=0):
+        """Continue from offset, which is at file line number lineno, or
+        from the next selected range after it"""
+        if offset == 0 and getattr(self, 'decoder', None) is not None:
+            self.decoder = type(self.decoder)()
+        with self.selection.cond:
+            self.i = bisect.bisect_right(self.selection.ends, offset)
+        self.pos = offset
+        self.lineno = lineno
+        self.f.seek(offset)
+
+    def tell(self):
+        return self.pos
+
+    def readline(self):
+        sel = self.selection
+        with sel.cond:
+            while True:
+                n = len(sel.ends)
+                if self.i < n and self.pos < sel.ends[self.i]:
+                    break
+                if self.i < n - 1:
+                    self.i += 1     # Only the last range may still grow
+                elif sel.done.is_set():
+                    return b""
+                else:
+                    sel.cond.wait()
+            # End while
+            if self.pos < sel.starts[self.i]:
+                self.pos = sel.starts[self.i]
+                self.lineno = sel.firstLines[self.i]
+                self.f.seek(self.pos)
+        line = self.f.readline()
+        self.pos += len(line)
+        self.lineno += 1
+        return line
+
+    def close(self):
+        self.f.close()
+# End SelectiveReader
+
+
+class FollowReader:
+    """Read a file that another process is still writing, like tail -f.
+
+    readline() waits for complete lines as the file grows.  When the file
+    is replaced (rotated) the new one is read from its start, and when it
+    is truncated reading starts again from the beginning.  On Linux the
+    wait is woken by inotify; elsewhere the file is polled at intervals
+    that grow from FOLLOW_MIN_POLL to FOLLOW_MAX_POLL while nothing
+    arrives.
+    """
+
+    def __init__(self, fName, fromEnd=False, log=print):
+        self.fName = fName
+        self.log = log
+        self.f = open(fName, 'rb')
+        self.inode = os.fstat(self.f.fileno()).st_ino
+        if fromEnd:
+            self.f.seek(0, os.SEEK_END)
+        self.partial = b""
+        self.interval = FOLLOW_MIN_POLL
+        self.stopped = False
+        self.notify = self._inotify()
+
+    def _inotify(self):
+        """inotify file descriptor watching the file's directory, or None"""
+        if platform.system() != 'Linux':
+            return None
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            # IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            directory = os.path.dirname(os.path.abspath(self.fName))
+            if libc.inotify_add_watch(fd, os.fsencode(directory),
+                                      0x002 | 0x040 | 0x080 | 0x100 |
+                                      0x200) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+    # End _inotify()
+
+    def _wait(self, timeout):
+        if self.notify is not None:
+            if select.select([self.notify], [], [], timeout)[0]:
+                try:
+                    while os.read(self.notify, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+        else:
+            time.sleep(min(self.interval, timeout))
+            self.interval = min(self.interval * 2, FOLLOW_MAX_POLL)
+
+    def _reopen(self):
+        """Start again after rotation or truncation.  Returns True when
+        there may be new data to read."""
+        try:
+            st = os.stat(self.fName)
+        except FileNotFoundError:
+            return False    # Rotated away, the new file is not there yet
+        if st.st_ino != self.inode:
+            self.log("'%s' was replaced, following the new file." %
+                     self.fName)
+            self.f.close()
+            self.f = open(self.fName, 'rb')
+            self.inode = os.fstat(self.f.fileno()).st_ino
+        elif st.st_size < self.f.tell():
+            self.log("'%s' was truncated, reading from the start." %
+                     self.fName)
+            self.f.seek(0)
+        else:
+            return False
+        self.partial = b""
+        return True
+
+    def readline(self, block=True, until=None):
+        """Return the next complete line, waiting for it to be written.
+        Returns None if block is False or the monotonic time until passes
+        before there is one, and b"" once stop() has been called."""
+        while not self.stopped:
+            line = self.f.readline()
+            if line:
+                self.partial += line
+                if line.endswith(b"\n"):
+                    line, self.partial = self.partial, b""
+                    self.interval = FOLLOW_MIN_POLL
+                    return line
+                continue
+            if self._reopen():
+                continue
+            if not block:
+                return None
+            timeout = 0.25  # Check for stop() this often
+            if until is not None:
+                timeout = min(timeout, until - time.monotonic())
+                if timeout <= 0:
+                    return None
+            self._wait(timeout)
+        # End while
+        return b""
+    # End readline()
+
+    def stop(self):
+        self.stopped = True
+
+    def close(self):
+        self.stopped = True
+        self.f.close()
+        if self.notify is not None:
+            os.close(self.notify)
+            self.notify = None
+# End FollowReader
+
+
+# Input formats.  Recordings in other formats than one NMEA sentence per
+# line are read through a decoder, which turns each line into a
+# (recording time, payload) pair.  Decoders are looked up by name in
+# DECODERS; registerDecoder() adds new ones.  A decoder class has
+#   name               the --format name
+#   sniff(lines)       the fraction, 0 to 1, of sample lines it recognises
+#   decode(line)       (time or None, payload); payload is None for lines
+#                      to skip, such as headers
+# and is created afresh for each pass through a file.
+DECODERS = collections.OrderedDict()
+
+
+def registerDecoder(decoder):
+    DECODERS[decoder.name] = decoder
+    return decoder
+
+
+# Seconds from a time of day (HH:MM:SS.sss), an ISO 8601 date and time
+# (UTC unless it has an offset) or UNIX seconds or milliseconds
+def parseTime(text):
+    text = text.strip()
+    if isinstance(text, bytes):
+        text = text.decode('ascii', 'replace')
+    if ':' not in text:
+        ts = float(text)
+        return ts / 1000.0 if ts > 1e11 else ts
+    if '-' not in text[:8]:
+        (h, m, sec) = text.split(':')
+        return int(h) * 3600 + int(m) * 60 + float(sec)
+    if text.endswith(('Z', 'z')):
+        text = text[:-1] + '+00:00'
+    when = datetime.datetime.fromisoformat(text.replace(' ', 'T', 1))
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return when.timestamp()
+# End parseTime()
+
+
+class DayRollover:
+    """Turns times of day into a steadily increasing time by adding a day
+    whenever the clock goes back by more than twelve hours"""
+
+    def __init__(self):
+        self.day = 0.0
+        self.last = None
+
+    def __call__(self, seconds):
+        if self.last is not None and seconds < self.last - 43200:
+            self.day += 86400.0
+        self.last = seconds
+        return self.day + seconds
+
+
+@registerDecoder
+class NmeaDecoder:
+    """One NMEA sentence per line, with or without an NMEAv4 tag block.
+    This is the native format and the player reads it without a decoder."""
+
+    name = 'nmea'
+
+    @staticmethod
+    def sniff(lines):
+        return sum(1 for line in lines
+                   if line.lstrip()[:1] in (b"$", b"!", b"\\")) / len(lines)
+
+    def decode(self, line):
+        line = line.strip()
+        return (getTimestamp(line), line)
+
+
+@registerDecoder
+class TimedDecoder:
+    """Sentences prefixed with their time, e.g. '12:34:56.789 $GPRMC,...',
+    '2023-06-01T12:34:56Z,$GPRMC,...' or '1685622896.5;!AIVDM,...'"""
+
+    name = 'timed'
+    LINE = re.compile(rb"\s*(\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(?:\.\d+)?"
+                      rb"(?:[Zz]|[+-]\d\d:?\d\d)?|\d\d?:\d\d:\d\d(?:\.\d+)?|"
+                      rb"\d{9,13}(?:\.\d+)?)[\s,;]+([$!\\].*)")
+
+    def __init__(self):
+        self.clock = DayRollover()
+
+    @classmethod
+    def sniff(cls, lines):
+        return sum(1 for line in lines if cls.LINE.match(line)) / len(lines)
+
+    def decode(self, line):
+        match = self.LINE.match(line)
+        if match is None:
+            return (None, None)
+        ts = parseTime(match.group(1))
+        if b":" in match.group(1) and b"-" not in match.group(1)[:8]:
+            ts = self.clock(ts)
+        return (ts, match.group(2).strip())
+# End TimedDecoder
+
+
+@registerDecoder
+class CsvDecoder:
+    """CSV exports such as those of the OpenCPN VDR plugin: a header row
+    naming a time column and a message column, and optionally a type
+    column.  Rows whose type is not NMEA 0183 (e.g. NMEA 2000) are
+    skipped."""
+
+    name = 'csv'
+    TIME_COLUMNS = ('timestamp', 'time', 'received_at', 'datetime', 'utc')
+    MESSAGE_COLUMNS = ('message', 'raw_data', 'raw', 'sentence', 'nmea',
+                       'data')
+    TYPE_COLUMNS = ('type', 'protocol')
+
+    def __init__(self):
+        self.columns = None
+        self.clock = DayRollover()
+
+    @classmethod
+    def header(cls, line):
+        """(time, message, type) column numbers of a header row, or None"""
+        names = [name.strip().lower() for name in
+                 next(csv.reader([line.decode('utf-8', 'replace')]), [])]
+        columns = []
+        for wanted in (cls.TIME_COLUMNS, cls.MESSAGE_COLUMNS,
+                       cls.TYPE_COLUMNS):
+            found = [i for (i, name) in enumerate(names) if name in wanted]
+            columns.append(found[0] if found else None)
+        if columns[0] is None or columns[1] is None:
+            return None
+        return tuple(columns)
+
+    @classmethod
+    def sniff(cls, lines):
+        return 1.0 if cls.header(lines[0]) else 0.0
+
+    def decode(self, line):
+        if self.columns is None:
+            self.columns = self.header(line)
+            return (None, None)
+        row = next(csv.reader([line.decode('utf-8', 'replace')]), [])
+        (timeCol, messCol, typeCol) = self.columns
+        if len(row) <= max(timeCol, messCol):
+            return (None, None)
+        if typeCol is not None and typeCol < len(row) and row[typeCol] and \
+                'NMEA0183' not in row[typeCol].upper().replace(' ', ''):
+            return (None, None)
+        payload = row[messCol].strip().encode('utf-8')
+        if payload[:1] not in (b"$", b"!", b"\\"):
+            return (None, None)
+        try:
+            ts = parseTime(row[timeCol])
+        except ValueError:
+            return (None, payload)
+        if ':' in row[timeCol] and '-' not in row[timeCol][:8]:
+            ts = self.clock(ts)
+        return (ts, payload)
+# End CsvDecoder
+
+
+@registerDecoder
+class ClockDecoder:
+    """Plain NMEA lines, such as NavMonPC logs, timed by the UTC time in
+    their own RMC, GGA, GLL, GNS and ZDA sentences.  Sentences without a
+    time are sent with the last one.  Never detected automatically, as
+    plain NMEA files are normally replayed with --sleep."""
+
+    name = 'clock'
+    TIME_FIELDS = {b"RMC": 1, b"GGA": 1, b"GNS": 1, b"ZDA": 1, b"GLL": 5}
+
+    def __init__(self):
+        self.date = None        # UNIX time of midnight of the current date
+        self.clock = DayRollover()
+        self.last = None
+
+    @staticmethod
+    def sniff(lines):
+        return 0.0
+
+    def decode(self, line):
+        line = line.strip()
+        start = max(line.rfind(b"\\") + 1, 0)
+        fields = line[start:].split(b"*")[0].split(b",")
+        field = self.TIME_FIELDS.get(fields[0][-3:])
+        try:
+            if field is not None and len(fields) > field and fields[field]:
+                t = fields[field]
+                sod = int(t[0:2]) * 3600 + int(t[2:4]) * 60 + float(t[4:])
+                date = None
+                if fields[0][-3:] == b"RMC" and len(fields) > 9 and \
+                        len(fields[9]) == 6:
+                    d = fields[9]
+                    year = int(d[4:6])
+                    date = (int(d[0:2]), int(d[2:4]),
+                            year + (2000 if year < 80 else 1900))
+                elif fields[0][-3:] == b"ZDA" and len(fields) > 4:
+                    date = (int(fields[2]), int(fields[3]), int(fields[4]))
+                if date is not None:
+                    self.date = datetime.datetime(
+                        date[2], date[1], date[0],
+                        tzinfo=datetime.timezone.utc).timestamp()
+                if self.date is not None:
+                    self.last = self.date + sod
+                else:
+                    self.last = self.clock(sod)
+        except ValueError:
+            pass    # A damaged sentence keeps the last time
+        return (self.last, line)
+# End ClockDecoder
+
+
+def sniffFormat(sample):
+    """Name of the registered decoder that best recognises the sample,
+    the first few KB of a recording"""
+    lines = [line for line in sample.split(b"\n")[:-1] if line.strip()]
+    if not lines:
+        return 'nmea'
+    best = ('nmea', 0.5)
+    for (name, decoder) in DECODERS.items():
+        score = decoder.sniff(lines)
+        if score > best[1]:
+            best = (name, score)
+    return best[0]
+# End sniffFormat()
+
+
+class DecodedReader:
+    """A binary file read through a decoder"""
+
+    def __init__(self, f, decoder):
+        self.f = f
+        self.decoder = decoder
+
+    def seek(self, offset):
+        if offset == 0:
+            self.decoder = type(self.decoder)()
+        self.f.seek(offset)
+
+    def tell(self):
+        return self.f.tell()
+
+    def readline(self):
+        return self.f.readline()
+
+    def close(self):
+        self.f.close()
+# End DecodedReader
+
+
+def formatDuration(seconds):
+    seconds = int(round(seconds))
+    return "%d:%02d:%02d" % (seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+
+# Open fName for playback.  With background True the timestamp index is
+# built on another thread so that playback can start at once; the line
+# count is then unknown (infinite) until index.done is set.  onIndexed is
+# called when a background index is complete.  follow 'start' or 'end'
+# keeps reading a growing file from its start or its current end.  The
+# input format is detected unless format names one of the DECODERS.
+def openFile(fName, policy=None, log=print, aisFilter=None, background=False,
+             onIndexed=None, follow=None, format='auto'):
+    Len = float('inf')
+    index = None
+    if fName is not None:
+        try:
+            f = open(fName, 'rb')
+        except FileNotFoundError:
+            log("File '%s' not found, exiting." % fName)
+            raise
+        # End try
+        sample = f.read(SNIFF_SIZE)
+        f.seek(0)
+    else:
+        f = sys.stdin.buffer
+        sample = f.peek(SNIFF_SIZE)[:SNIFF_SIZE]
+    # End if
+    if format in (None, 'auto'):
+        format = sniffFormat(sample)
+    if format not in DECODERS:
+        raise ValueError("Unknown input format '%s'" % format)
+    decoder = None if format == 'nmea' else DECODERS[format]
+    if decoder is not None:
+        log("Reading %s input: %s" % (format, decoder.__doc__.split("\n")[0]))
+    if fName is not None and follow:
+        # A growing file is neither counted nor indexed
+        f.close()
+        f = FollowReader(fName, follow == 'end', log)
+        log("Following file '%s', Type Ctrl-C to exit..." % fName)
+    elif fName is not None:
+        log("Playing file '%s', Type Ctrl-C to exit..." % fName)
+        selection = AisSelection(aisFilter) if aisFilter else None
+        if background:
+            def indexed():
+                if selection is not None:
+                    log(selection.summary())
+                if onIndexed is not None:
+                    onIndexed()
+            index = TimestampIndex(policy or GapPolicy())
+            indexInBackground(fName, index, indexed, decoder and decoder(),
+                              selection)
+        else:
+            index = indexFile(f, policy or GapPolicy(), selection,
+                              decoder=decoder and decoder())
+            Len = index.lines
+            if selection is not None:
+                log(selection.summary())
+        if selection is not None:
+            # Line numbers and Len count every line of the file, as the
+            # index does, so that progress and seek positions agree
+            f = SelectiveReader(f, selection)
+    # End if
+    if decoder is not None:
+        if isinstance(f, (FollowReader, SelectiveReader)):
+            f.decoder = decoder()
+            if follow == 'end':
+                f.decoder.decode(sample.split(b"\n")[0])   # CSV header
+        else:
+            f = DecodedReader(f, decoder())
+    return (f, Len, index)
+# End openFile()
+
+
+def getNextMessage(f, sched, block=True, until=None):
+    if not f:
+        sched.log("End of file reached...")
+        return False
+    # End if
+    follow = isinstance(f, FollowReader)
+    selective = isinstance(f, SelectiveReader)
+    decoder = getattr(f, 'decoder', None)
+    while not sched.stopped:
+        offset = sched.takeSeek()
+        if offset is not None:
+            if selective:
+                f.seek(offset, sched.line)
+            else:
+                f.seek(offset)
+        pending = sched.takePending(block, until)
+        if pending is not None:
+            mess, due = pending
+        else:
+            mess = f.readline(block, until) if follow else f.readline()
+            if mess is None:
+                return None     # Nothing new written yet
+            if len(mess) == 0:
+                return False
+            # End if
+            sched.line = f.lineno if selective else sched.line + 1
+            if decoder is None:
+                mess = mess.strip()
+                due = sched.delayMessage(mess, block, until)
+            else:
+                (ts, mess) = f.decoder.decode(mess)
+                if mess is None:
+                    continue    # Not a sentence, e.g. a header row
+                due = sched.schedule(ts, mess, block, until)
+        if due is None:
+            return None     # Not due yet, kept back for the next call
+        if due:
+            return mess + b"\r\n"
+        # A seek or stop arrived while waiting, drop this message
+    # End while
+    return False
+# End getNextMessage()
+
+
+# Parse a control channel time: seconds or H:MM:SS from the start of the
+# recording, or @UNIX-seconds for an absolute recording time.
+def parseSeekTime(arg, start):
+    if arg.startswith('@'):
+        return float(arg[1:])
+    seconds = 0.0
+    for part in arg.split(':'):
+        seconds = seconds * 60 + float(part)
+    return start + seconds
+# End parseSeekTime()
+
+
+class Scheduler:
+    """Turns recording timestamps into wall-clock send deadlines.
+
+    Timestamped messages are replayed on a timeline whose gaps have been
+    compressed by the gap policy, at Speed times real time.  Messages
+    without a timestamp are separated by a fixed Delay.
+
+    pause(), resume(), seek() and set_speed() may be called from another
+    thread; the timeline is re-based at once and any wait in progress is
+    woken up.
+    """
+
+    # A Delay of 0 or less (--sleep=0) sends timed messages at once too
+    FAST_AT_ZERO_DELAY = True
+
+    def __init__(self, Delay, Speed, policy=None, index=None, log=print):
+        if Speed <= 0:
+            raise ValueError("Speed factor must be positive")
+        self.Delay = Delay
+        self.Speed = Speed
+        self.policy = policy or GapPolicy()
+        self.index = index
+        self.announced = False
+        self.paused = False
+        self.pausedAt = None    # Timeline position when paused
+        self.seekTo = None      # Index entry requested by seek()
+        self.stopped = False
+        self.catchUp = False    # Drop messages missed while stopped
+        self.skipped = 0
+        self.lag = 0.0          # Seconds the last message was sent late
+        self.notBefore = 0.0    # Monotonic time set by startAt()
+        self.log = log
+        self.described = False
+        self.cond = threading.Condition()
+        self.clock = time.monotonic
+        self.restart()
+
+    def restart(self):
+        """Start a new pass through the recording"""
+        with self.cond:
+            self.epoch = None   # Monotonic clock time of vtime == base
+            self.base = 0.0
+            self.lastTs = None
+            self.vtime = 0.0
+            self.line = 0
+            self.pending = None     # (mess, due, timed) read ahead
+
+    def startAt(self, when):
+        """Hold the first pass back until UNIX time when and start its
+        timeline there, so that players started apart, even on hosts
+        whose clocks are synchronised, keep in step"""
+        with self.cond:
+            self.epoch = self.clock() + (when - time.time())
+            self.base = 0.0
+            self.notBefore = self.epoch
+            self.cond.notify_all()
+
+    def playhead(self):
+        """Current position on the compressed timeline"""
+        if self.paused:
+            return self.pausedAt
+        if self.epoch is None:
+            return None
+        return self.base + (self.clock() - self.epoch) * self.Speed
+
+    def _rebase(self, vt):
+        self.base = vt
+        self.epoch = self.clock()
+
+    def _waitUntil(self, deadline):
+        while True:
+            if self.seekTo is not None or self.stopped:
+                return False
+            if self.paused:
+                self.cond.wait()
+                continue
+            wait = deadline() - self.clock()
+            if wait <= 0:
+                self.lag = -wait
+                return True
+            self.cond.wait(wait)
+    # End _waitUntil()
+
+    def _deadline(self, ts):
+        """Move the timeline on to recording time ts (None for a message
+        without one) and return a function giving the monotonic time it
+        is due.  As before timestamps were honoured, a Delay of 0 or less
+        (--sleep=0) sends every message as fast as possible."""
+        if ts is None or (self.Delay <= 0 and self.FAST_AT_ZERO_DELAY):
+            due = max(self.clock(), self.notBefore) + max(self.Delay, 0)
+            return lambda: due
+        if self.lastTs is not None:
+            self.vtime += self.policy.compress(ts - self.lastTs)
+        self.lastTs = ts
+        if not self.announced:
+            self.log("NMEAv4 timestamp found. Replaying logs at %3.2fx "
+                  "speed, instead of using delay." % self.Speed)
+            self.announced = True
+        if self.epoch is None:
+            self._rebase(self.vtime)
+            if self.paused:
+                self.pausedAt = self.vtime
+        vt = self.vtime
+        return lambda: self.epoch + (vt - self.base) / self.Speed
+
+    def _release(self, mess, deadline, timed, block, until):
+        if self.catchUp:
+            # Only a timed message tells whether playback has caught up.
+            # Untimed ones are sent, unless they come between messages
+            # that were missed.
+            if timed:
+                if deadline() < self.clock() - CATCH_UP_TOLERANCE:
+                    self.skipped += 1
+                    return False
+                self.catchUp = False
+                if self.skipped:
+                    self.log("Skipped %d messages that fell due while "
+                             "stopped." % self.skipped)
+            elif self.skipped:
+                self.skipped += 1
+                return False
+        # End if
+        if not block:
+            until = None
+            if self.paused or deadline() > self.clock():
+                if self.seekTo is not None or self.stopped:
+                    return False
+                self.pending = (mess, deadline, timed)
+                return None
+        elif until is not None:
+            if not self._waitUntil(lambda: min(deadline(), until)):
+                return False
+            if deadline() > self.clock():
+                self.pending = (mess, deadline, timed)
+                return None
+        return self._waitUntil(deadline)
+
+    def delayMessage(self, mess, block=True, until=None):
+        """Wait until mess is due.  Returns False if a seek interrupted
+        the wait and the message should be dropped.  A message that is
+        not due yet is kept for takePending() and None is returned
+        instead of waiting when block is False, or once the monotonic
+        time until has passed."""
+        return self.schedule(getTimestamp(mess), mess, block, until)
+    # End delayMessage()
+
+    def schedule(self, ts, mess, block=True, until=None):
+        """delayMessage() for a message whose recording time ts has been
+        decoded already"""
+        with self.cond:
+            return self._release(mess, self._deadline(ts), ts is not None,
+                                 block, until)
+
+    def takePending(self, block=True, until=None):
+        """Release the message kept back by delayMessage().  Returns
+        (mess, due) where due is as for delayMessage(), or None when
+        nothing is pending."""
+        with self.cond:
+            if self.pending is None:
+                return None
+            mess, deadline, timed = self.pending
+            self.pending = None
+            return mess, self._release(mess, deadline, timed, block, until)
+
+    def stop(self):
+        """Abandon any wait in progress and all later ones"""
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def pause(self):
+        with self.cond:
+            if not self.paused:
+                self.pausedAt = self.playhead()
+                self.paused = True
+                self.cond.notify_all()
+
+    def resume(self):
+        with self.cond:
+            if self.paused:
+                self.paused = False
+                if self.pausedAt is not None:
+                    self._rebase(self.pausedAt)
+                self.cond.notify_all()
+
+    def set_speed(self, Speed):
+        if Speed <= 0:
+            raise ValueError("Speed factor must be positive")
+        with self.cond:
+            vt = self.playhead()
+            if vt is not None and not self.paused:
+                self._rebase(vt)
+            self.Speed = Speed
+            self.cond.notify_all()
+
+    def seek(self, ts):
+        """Continue playback from the first message at or after recording
+        time ts"""
+        if self.index is None or len(self.index) == 0:
+            if self.index is not None and not self.index.done.is_set():
+                raise ValueError("The recording is still being indexed")
+            raise ValueError("Seeking needs a timestamped input file")
+        with self.cond:
+            self.seekTo = self.index.find(ts)
+            self.cond.notify_all()
+
+    def takeSeek(self):
+        """Apply a pending seek.  Returns the byte offset to read from next,
+        or None when no seek is pending."""
+        with self.cond:
+            i = self.seekTo
+            if i is None:
+                return None
+            self.seekTo = None
+            self.pending = None
+            self.line = self.index.linenos[i]
+            self.lastTs = self.index.stamps[i]
+            self.vtime = self.index.vtimes[i]
+            self._rebase(self.vtime)
+            if self.paused:
+                self.pausedAt = self.vtime
+            return self.index.offsets[i]
+
+    def checkpoint(self):
+        """Dictionary of the timeline state for restore(): the position
+        reached, the UNIX time the timeline was at base, and any message
+        read ahead but not sent yet"""
+        with self.cond:
+            state = {'line': self.line, 'lastTs': self.lastTs,
+                     'vtime': self.vtime, 'base': self.base,
+                     'epoch': None, 'speed': self.Speed,
+                     'pending': None, 'pendingTime': None}
+            if self.paused:
+                state['base'] = self.pausedAt or self.vtime
+                state['epoch'] = time.time()
+            elif self.epoch is not None:
+                state['epoch'] = time.time() - (self.clock() - self.epoch)
+            if self.pending is not None:
+                (mess, deadline, timed) = self.pending
+                state['pending'] = mess.decode('latin-1')
+                if timed:
+                    state['pendingTime'] = self.vtime
+            return state
+    # End checkpoint()
+
+    def restore(self, state):
+        """Continue the timeline saved by checkpoint().  Messages that
+        fell due while the player was stopped are skipped, so playback
+        carries on where it would have been."""
+        with self.cond:
+            self.line = state['line']
+            self.lastTs = state['lastTs']
+            self.vtime = state['vtime']
+            self.base = state['base']
+            self.Speed = state['speed']
+            if state['epoch'] is not None:
+                self.epoch = self.clock() - (time.time() - state['epoch'])
+            if state['pending'] is not None:
+                mess = state['pending'].encode('latin-1')
+                vt = state['pendingTime']
+                if vt is None:
+                    due = self.clock() + max(self.Delay, 0)
+                    self.pending = (mess, lambda: due, False)
+                else:
+                    self.pending = (mess, lambda: self.epoch +
+                                    (vt - self.base) / self.Speed, True)
+            # End if
+            self.catchUp = True
+            self.skipped = 0
+    # End restore()
+
+    def status(self):
+        with self.cond:
+            state = 'paused' if self.paused else 'playing'
+            position = '-'
+            if self.lastTs is not None and self.index is not None \
+                    and len(self.index) > 0:
+                position = formatDuration(self.lastTs - self.index.stamps[0])
+            return "state=%s speed=%g line=%d position=%s" % (
+                state, self.Speed, self.line, position)
+
+    def describe(self):
+        """Print the recording span and expected replay time, once the
+        index is complete"""
+        if self.index is None or not self.index.done.is_set() or \
+                len(self.index) == 0:
+            return
+        with self.cond:
+            if self.described:
+                return
+            self.described = True
+        (recorded, replayed) = self.index.span()
+        if self.Delay <= 0 and self.FAST_AT_ZERO_DELAY:
+            self.log("Recording spans %s, replayed as fast as possible "
+                     "(--sleep=0)." % formatDuration(recorded))
+            return
+        self.log("Recording spans %s, replay takes %s at %3.2fx speed "
+              "(gaps: %s)." % (formatDuration(recorded),
+                               formatDuration(replayed / self.Speed),
+                               self.Speed, self.policy))
+# End Scheduler
+
+
+class OfflineScheduler(Scheduler):
+    """Scheduler on a virtual clock for --output.  Instead of waiting for
+    a message, the clock jumps to the time it is due, so a recording is
+    retimed as fast as it can be read.  now is the replay time reached,
+    in seconds from the start.  Timed messages always keep their
+    timestamps; Delay only spaces untimed ones, and may be 0."""
+
+    FAST_AT_ZERO_DELAY = False
+
+    def __init__(self, *args, **kwargs):
+        Scheduler.__init__(self, *args, **kwargs)
+        self.now = 0.0
+        self.clock = lambda: self.now
+
+    def _deadline(self, ts):
+        # Once a timestamp has placed the pass on the timeline, untimed
+        # lines go out with the last timed one.  Moving the clock on by
+        # Delay for each would make the later timestamps drift.
+        if ts is None and self.lastTs is not None:
+            due = self.now
+            return lambda: due
+        return Scheduler._deadline(self, ts)
+
+    def _waitUntil(self, deadline):
+        if self.seekTo is not None or self.stopped:
+            return False
+        self.now = max(self.now, deadline())
+        return True
+# End OfflineScheduler
+
+
+class ControlServer:
+    """Line based playback control on a local TCP port.
+
+    Commands are 'pause', 'resume', 'seek TIME', 'speed FACTOR' and
+    'status'.  TIME is seconds or H:MM:SS from the start of the recording,
+    or @UNIX-seconds.  Every command is answered with a line starting with
+    OK or ERR.
+    """
+
+    def __init__(self, sched, Host, Port, log=print):
+        self.sched = sched
+        self.log = log
+        self.sel = selectors.DefaultSelector()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+        self.server.bind((Host, Port))
+        self.server.listen(5)
+        self.server.setblocking(False)
+        self.sel.register(self.server, selectors.EVENT_READ, data=None)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        listening = self.server.getsockname()
+        self.log("Control channel at address: " + str(listening[0]) +
+                 " is listening on port: " + str(listening[1]))
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join(1.0)
+        for key in list(self.sel.get_map().values()):
+            self.sel.unregister(key.fileobj)
+            key.fileobj.close()
+        self.sel.close()
+
+    def run(self):
+        while self.running:
+            for key, mask in self.sel.select(timeout=0.25):
+                if key.data is None:
+                    conn, addr = self.server.accept()
+                    conn.setblocking(False)
+                    self.sel.register(conn, selectors.EVENT_READ,
+                                      data=types.SimpleNamespace(inb=b""))
+                else:
+                    self.serviceClient(key)
+    # End run()
+
+    def serviceClient(self, key):
+        conn = key.fileobj
+        try:
+            recv_data = conn.recv(1024)
+        except OSError:
+            recv_data = b""
+        if not recv_data:
+            self.sel.unregister(conn)
+            conn.close()
+            return
+        key.data.inb += recv_data
+        while b"\n" in key.data.inb:
+            line, key.data.inb = key.data.inb.split(b"\n", 1)
+            reply = self.command(line.decode("utf-8", "replace").strip())
+            try:
+                conn.sendall((reply + "\r\n").encode("utf-8"))
+            except OSError:
+                pass
+    # End serviceClient()
+
+    def command(self, line):
+        words = line.split()
+        if not words:
+            return "ERR empty command"
+        cmd = words[0].lower()
+        try:
+            if cmd == 'pause':
+                self.sched.pause()
+            elif cmd == 'resume':
+                self.sched.resume()
+            elif cmd == 'speed' and len(words) == 2:
+                self.sched.set_speed(float(words[1]))
+            elif cmd == 'seek' and len(words) == 2:
+                index = self.sched.index
+                start = index.stamps[0] if index is not None and \
+                    len(index) > 0 else 0.0
+                self.sched.seek(parseSeekTime(words[1], start))
+            elif cmd != 'status':
+                return "ERR unknown command: " + line
+        except ValueError as ex:
+            return "ERR %s" % ex
+        return "OK " + self.sched.status()
+    # End command()
+# End ControlServer
+
+
+class Player:
+    """Importable playback engine.
+
+    Plays fName over UDP or TCP, either blocking in run() or on a worker
+    thread with start().  The playback can be controlled from any thread
+    with stop(), pause(), resume(), seek() and set_speed().  Messages that
+    the command line version prints are passed to on_log, and
+    on_progress(line, lines) and on_stats(stats) are called at most every
+    progressInterval seconds while playing.
+    """
+
+    def __init__(self, fName, mode='UDP', Dest=None, Host=None, Port=None,
+                 Delay=0.1, Repeat=1, Speed=1.0, Gap=None, Control=None,
+                 Ais=None, McastTTL=1, McastIf=None, McastLoop=True,
+                 TcpNoDelay=True, TcpCork=False, Subscribe=None, Listen=(),
+                 Serial='pty', Baud=4800, SerialBuffer=1024, Overflow='queue',
+                 MaxRate=None, MaxBytes=None, Burst=1.0, Follow=None,
+                 Format='auto', Shm='vdr', ShmSize=RING_SIZE, Output=None,
+                 Retime=None, Checkpoint=None, Resume=None, StartAt=None,
+                 Partition=None, on_log=None, on_progress=None, on_stats=None,
+                 progressInterval=0.25):
+        self.fName = fName
+        self.mode = mode.upper()
+        self.Dest = Dest
+        self.Host = Host
+        self.Port = Port
+        self.Delay = Delay
+        self.Repeat = Repeat
+        self.Speed = Speed
+        self.Gap = Gap or GapPolicy()
+        self.Control = Control
+        self.Ais = Ais
+        self.McastTTL = McastTTL
+        self.McastIf = McastIf
+        self.McastLoop = McastLoop
+        self.TcpNoDelay = TcpNoDelay
+        self.TcpCork = TcpCork
+        self.Subscribe = Subscribe
+        self.Listen = Listen
+        self.Serial = Serial
+        self.Baud = Baud
+        self.SerialBuffer = SerialBuffer
+        self.Overflow = Overflow
+        self.MaxRate = MaxRate
+        self.MaxBytes = MaxBytes
+        self.Burst = Burst
+        self.Follow = Follow
+        self.Format = Format
+        self.Shm = Shm
+        self.ShmSize = ShmSize
+        self.Output = Output
+        self.Retime = Retime
+        self.Checkpoint = Checkpoint or Resume
+        self.Resume = Resume
+        self.StartAt = StartAt
+        self.Partition = Partition
+        self.on_log = on_log
+        self.on_progress = on_progress
+        self.on_stats = on_stats
+        self.progressInterval = progressInterval
+        self.sched = None
+        self.shaper = None
+        self.partition = None
+        self.sel = None
+        self.thread = None
+        self.result = None
+        self.stopping = False
+        self.f = False
+        self.lines = 0
+        self.pass_ = 0
+        self.sent = 0
+        self.bytes = 0
+        self.errors = 0
+        self.dropped = 0
+        self.startup = None     # Seconds from launch to the first message
+        self.launched = None    # perf_counter() at process launch, or None
+        self.waited = 0.0       # Seconds spent waiting for a first client
+        self.state = None       # Last checkpoint taken
+        self.requeued = []      # Rate limited messages from a checkpoint
+        self.lastCheckpoint = 0.0
+        self.lastReport = 0.0
+        self.pct = percentComplete(5.0)
+
+    def log(self, message):
+        if self.on_log:
+            self.on_log(message)
+        else:
+            print(message)
+
+    def start(self):
+        """Run the player on a daemon worker thread"""
+        if self.running():
+            raise RuntimeError("Player is already running")
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def join(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+        return self.result
+
+    def run(self):
+        """Play the file.  Returns True when playback ended normally."""
+        self.result = None
+        self.pass_ = 0
+        self.sent = 0
+        self.bytes = 0
+        self.errors = 0
+        self.dropped = 0
+        self.started = time.perf_counter()
+        self.startup = None
+        self.waited = 0.0
+        self.state = None
+        self.requeued = []
+        self.shaper = None
+        if (self.MaxRate or self.MaxBytes) and self.mode != 'FILE':
+            self.shaper = Shaper(self.MaxRate, self.MaxBytes, self.Burst,
+                                 self.Overflow)
+        self.partition = None
+        try:
+            if self.Partition:
+                self.partition = Partition(*self.Partition)
+            if self.mode == 'UDP':
+                self.result = self._udp()
+            elif self.mode == 'TCP':
+                self.result = self._tcp()
+            elif self.mode == 'SERIAL':
+                self.result = self._serial()
+            elif self.mode == 'SHM':
+                self.result = self._shm()
+            elif self.mode == 'FILE':
+                self.result = self._file()
+            else:
+                self.log("Unknown mode '%s'" % self.mode)
+                self.result = False
+        except FileNotFoundError:
+            self.result = False
+        except OSError as ex:
+            self.log("Exception...")
+            self.log(str(ex))
+            self.result = False
+        except ValueError as ex:
+            self.log("Error: %s" % ex)
+            self.result = False
+        finally:
+            if self.Checkpoint and self.state is not None:
+                if self.result and not self.stopping:
+                    # The replay is complete, there is nothing to resume
+                    try:
+                        os.remove(self.Checkpoint)
+                    except OSError:
+                        pass
+                else:
+                    saveCheckpoint(self.Checkpoint, self.state)
+                    self.log("Checkpoint saved to %s at line %d." %
+                             (self.Checkpoint, self.state['line']))
+            # End if
+            if self.f:
+                self.f.close()
+                self.f = False
+            if self.shaper is not None:
+                self.log(self.shaper.summary())
+            self._report(force=True)
+        return self.result
+    # End run()
+
+    def stop(self):
+        self.stopping = True
+        if self.sched:
+            self.sched.stop()
+        if isinstance(self.f, FollowReader):
+            self.f.stop()
+
+    def _scheduler(self):
+        if self.sched is None:
+            raise ValueError("Player is not running")
+        return self.sched
+
+    def pause(self):
+        self._scheduler().pause()
+
+    def resume(self):
+        self._scheduler().resume()
+
+    def seek(self, ts):
+        self._scheduler().seek(ts)
+
+    def set_speed(self, Speed):
+        self._scheduler().set_speed(Speed)
+        self.Speed = Speed
+
+    def stats(self):
+        """Snapshot of the playback state as a dictionary"""
+        sched = self.sched
+        stats = {'state': 'stopped', 'line': 0, 'lines': self.lines,
+                 'pass': self.pass_, 'sent': self.sent, 'bytes': self.bytes,
+                 'errors': self.errors, 'dropped': self.dropped,
+                 'shaped': self.shaper.shaped if self.shaper else 0,
+                 'startup': self.startup, 'lag': None,
+                 'speed': self.Speed,
+                 'clients': self._clientCount(), 'position': None,
+                 'start': None, 'span': None}
+        if sched is not None:
+            if self.result is None and not self.stopping:
+                stats['state'] = 'paused' if sched.paused else 'playing'
+            stats['line'] = sched.line
+            stats['lag'] = sched.lag
+            stats['speed'] = sched.Speed
+            index = sched.index
+            if index is not None and len(index) > 0:
+                stats['start'] = index.stamps[0]
+                stats['span'] = index.span()[0]
+                if sched.lastTs is not None:
+                    stats['position'] = sched.lastTs - index.stamps[0]
+        return stats
+    # End stats()
+
+    def clientList(self):
+        """List of (address, queued bytes) for every connected TCP client,
+        or None if the client table changed while it was being read"""
+        if self.sel is None:
+            return []
+        try:
+            return [(client.addr, client.queued)
+                    for client in list(self.subs.clients)]
+        except RuntimeError:
+            return None
+
+    def _clientCount(self):
+        if self.sel is None:
+            return 0
+        return len(self.subs.clients)
+
+    def _report(self, force=False):
+        if self.on_progress is None and self.on_stats is None:
+            if self.sched is not None and 0 < self.lines < float('inf'):
+                self.pct.printPercent(self.sched.line / self.lines * 100,
+                                      self.on_log)
+            return
+        now = time.monotonic()
+        if not force and now - self.lastReport < self.progressInterval:
+            return
+        self.lastReport = now
+        if self.on_progress is not None and self.sched is not None:
+            self.on_progress(self.sched.line, self.lines)
+        if self.on_stats is not None:
+            self.on_stats(self.stats())
+    # End _report()
+
+    def _open(self):
+        (self.f, self.lines, index) = openFile(self.fName, self.Gap, self.log,
+                                               self.Ais, background=True,
+                                               onIndexed=self._indexed,
+                                               follow=self.Follow,
+                                               format=self.Format)
+        cls = OfflineScheduler if self.mode == 'FILE' else Scheduler
+        self.sched = cls(self.Delay, self.Speed, self.Gap, index,
+                         log=self.log)
+        if self.stopping:
+            self.sched.stop()
+        if self.Resume:
+            self._restore()
+        if self.StartAt is not None:
+            self.sched.startAt(self.StartAt)
+            self.log("Playback starts at %s." % time.strftime(
+                "%H:%M:%S", time.localtime(self.StartAt)))
+        if self.partition is not None:
+            self.log("Playing part %s of the messages." % self.partition)
+        if index is not None and index.done.is_set():
+            self._indexed()
+
+    def _restore(self):
+        """Continue from the checkpoint in Resume"""
+        state = loadCheckpoint(self.Resume)
+        if os.path.realpath(state['file']) != os.path.realpath(self.fName):
+            raise ValueError("Checkpoint %s is for %s" % (self.Resume,
+                                                          state['file']))
+        if state['offset'] > os.path.getsize(self.fName):
+            raise ValueError("%s is shorter than when checkpoint %s was "
+                             "saved" % (self.fName, self.Resume))
+        if getattr(self.f, 'decoder', None) is not None:
+            with open(self.fName, 'rb') as f:
+                self.f.decoder.decode(f.readline())     # CSV header
+        if isinstance(self.f, SelectiveReader):
+            self.f.seek(state['offset'], state['line'])
+        else:
+            self.f.seek(state['offset'])
+        self.sched.restore(state)
+        self.requeued = [mess.encode('latin-1')
+                         for mess in state.get('queued', [])]
+        self.pass_ = state['pass']
+        self.log("Resuming pass %d at line %d from checkpoint %s." %
+                 (self.pass_ + 1, state['line'], self.Resume))
+    # End _restore()
+
+    def _checkpoint(self):
+        """Note the state after a batch has been sent, and save it every
+        CHECKPOINT_INTERVAL seconds"""
+        state = self.sched.checkpoint()
+        state['version'] = CHECKPOINT_VERSION
+        state['file'] = os.path.abspath(self.fName)
+        state['offset'] = self.f.tell()
+        state['pass'] = self.pass_
+        state['queued'] = [mess.decode('latin-1') for mess in
+                           (self.shaper.queue if self.shaper else ())]
+        self.state = state
+        now = time.monotonic()
+        if now - self.lastCheckpoint >= CHECKPOINT_INTERVAL:
+            self.lastCheckpoint = now
+            saveCheckpoint(self.Checkpoint, state)
+    # End _checkpoint()
+
+    def _indexed(self):
+        # Called on the indexing thread when a background index is done
+        sched = self.sched
+        if sched is not None and self.lines == float('inf'):
+            self.lines = sched.index.lines
+            sched.describe()
+
+    def _startControl(self):
+        if self.Control:
+            control = ControlServer(self.sched, *self.Control, log=self.log)
+            control.start()
+            return control
+        return False
+
+    def _nextMessage(self, until=None):
+        """Return the next message, starting the next repeat at end of
+        file, or False when playback is complete.  Returns None if the
+        monotonic time until passes before a message is due."""
+        while True:
+            mess = getNextMessage(self.f, self.sched, until=until)
+            self._report()
+            if mess is None or mess or self.stopping:
+                return mess
+            if self.on_log is None:
+                print("")       # End the percent complete line
+            self.pass_ += 1
+            if self.pass_ >= self.Repeat:
+                return False
+            remaining = self.Repeat - self.pass_
+            self.f.seek(0)
+            self.sched.restart()
+            if remaining > 1:
+                self.log("Repeating file...%d more times." % remaining)
+            else:
+                self.log("Repeating file...%d more time." % remaining)
+    # End _nextMessage()
+
+    def _nextBatch(self, until=None):
+        """Wait for the next message and gather every later one that is
+        already due, so that a tick is written out in one go.  Returns an
+        empty list when playback is complete, or None if the monotonic
+        time until passes first."""
+        mess = self._nextMessage(until)
+        if mess is None:
+            return None
+        if not mess:
+            return []
+        if self.startup is None:
+            # From the launch of the program for its first replay, without
+            # any wait for a TCP client to connect
+            begin = self.started if self.launched is None else self.launched
+            self.startup = time.perf_counter() - begin - self.waited
+            self.log("First message ready %.1f ms after %s." %
+                     (self.startup * 1000,
+                      "start" if self.launched is None else "launch"))
+            self.launched = None
+        batch = [mess]
+        while len(batch) < MAX_BATCH_MESSAGES and not self.stopping:
+            mess = getNextMessage(self.f, self.sched, block=False)
+            if not mess:
+                break   # Not due yet, or end of file for _nextMessage()
+            batch.append(mess)
+        return batch
+    # End _nextBatch()
+
+    def _batches(self, poll=None):
+        """Iterate over the lists of messages to send.  With a Partition
+        the other parts' messages are still waited for, to keep the
+        timeline, but left out.  With rate limits
+        the messages pass through the Shaper, and the wait for the next
+        message ends early whenever a queued message may be sent.  With
+        poll the wait also ends every poll seconds, yielding an empty list
+        so that the caller can look after its connections.  Messages
+        still waiting for the rate limit at a resumed checkpoint come
+        first."""
+        shaper = self.shaper
+        (requeued, self.requeued) = (self.requeued, [])
+        if shaper is not None:
+            shaper.queue.extend(requeued)
+        elif requeued:
+            yield requeued
+        while True:
+            until = shaper.nextRelease() if shaper is not None else None
+            if poll is not None:
+                wake = time.monotonic() + poll
+                until = wake if until is None else min(until, wake)
+            batch = self._nextBatch(until)
+            if batch == []:
+                break
+            if batch and self.partition is not None:
+                batch = [mess for mess in batch if self.partition.keep(mess)]
+            if shaper is not None:
+                dropped = shaper.dropped
+                batch = shaper.admit(batch or [])
+                self.dropped += shaper.dropped - dropped
+            if batch:
+                yield batch
+                if self.Checkpoint:
+                    self._checkpoint()
+            elif poll is not None:
+                yield []
+        # End while
+        # Send what is still queued at the limited rate
+        while shaper is not None and shaper.queue and not self.stopping:
+            time.sleep(max(0.0, shaper.nextRelease() - time.monotonic()))
+            out = shaper.admit([])
+            if out:
+                yield out
+                if self.Checkpoint:
+                    self._checkpoint()
+    # End _batches()
+
+    def _udp(self):
+        Dest = self.Dest
+        Port = self.Port
+        if Dest is None:
+            Dest = socket.gethostbyname(socket.gethostname())
+        # End if
+        if Port is None:
+            Port = 10110
+        # End if
+        sock = False
+        control = False
+        try:
+            self._open()
+            if self.lines > 0:
+                self.log("  UDP target IP: " + Dest)
+                self.log("UDP target port: " + str(Port))
+                self.log("Inserting %3.2f mS delay between each message." %
+                         (self.Delay * 1000))
+                self.sched.describe()
+            control = self._startControl()
+            sock = socket.socket(socket.AF_INET,    # Internet
+                                 socket.SOCK_DGRAM)  # UDP
+            # Allow UDP broadcast
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            # Add socket reuse for better cross-platform compatibility
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if isMulticast(Dest):
+                setMulticastOptions(sock, self.McastTTL, self.McastIf,
+                                    self.McastLoop)
+                self.log("Multicast TTL %d, loopback %s, interface %s" %
+                         (self.McastTTL, 'on' if self.McastLoop else 'off',
+                          self.McastIf or 'default'))
+
+            consecutive_errors = 0
+            max_consecutive_errors = 5
+
+            for batch in self._batches():
+                # End if
+
+                # Send each message to client with reasonable
+                # number of retries before giving up.
+                for nextMessage in batch:
+                    try:
+                        sock.sendto(nextMessage, (Dest, Port))
+                        self.sent += 1
+                        self.bytes += len(nextMessage)
+                        consecutive_errors = 0  # Reset error counter on success
+                    except socket.error as e:
+                        consecutive_errors += 1
+                        self.errors += 1
+                        self.log(f"\nSocket error: {e} (attempt {consecutive_errors})")
+                        if consecutive_errors >= max_consecutive_errors:
+                            self.log("Too many consecutive socket errors, exiting...")
+                            return False
+                        # Brief pause before retry
+                        time.sleep(0.1)
+                # End for
+            # End for
+            return True
+        finally:
+            if control:
+                control.stop()
+            if sock:
+                sock.close()
+        # End try
+    # End _udp()
+
+    # The TCP version is more complex because we want to
+    # accept multiple client connections simultaneously.
+    def _tcp(self):
+        Host = self.Host
+        Port = self.Port
+        if Host is None:
+            Host = socket.gethostbyname(socket.gethostname())
+        Host = socket.gethostbyname(Host)
+        if Port is None:
+            Port = 2947
+        sel = selectors.DefaultSelector()
+        self.subs = Subscriptions()
+        self.servers = {}       # Listening socket -> default subscription
+        control = False
+        try:
+            for (lPort, patterns) in [(Port, self.Subscribe)] + list(self.Listen):
+                Server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                Server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+
+                # Add TCP keep-alive for better connection stability across platforms
+                Server.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+                # Platform-specific TCP keep-alive settings (where supported)
+                try:
+                    if platform.system() != 'Windows':  # Unix-like systems
+                        Server.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 1)
+                        Server.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 3)
+                        Server.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 5)
+                except (AttributeError, OSError):
+                    pass  # Not all systems support these options
+
+                sel.register(Server, selectors.EVENT_READ, data=None)
+                Server.bind((Host, lPort))
+                Server.listen(TCP_LISTEN_BACKLOG)
+                Server.setblocking(False)
+                self.servers[Server] = patterns
+            # End for
+            self.sel = sel
+            raiseFileLimit()
+            self._open()
+            if self.lines > 0:
+                for (Server, patterns) in self.servers.items():
+                    listening = Server.getsockname()
+                    self.log("Server at address: " + str(listening[0]) +
+                             " is listening on port: " + str(listening[1]) +
+                             ("" if patterns is None else
+                              " for " + formatSubscription(patterns)))
+                self.sched.describe()
+            control = self._startControl()
+            # The wait for the next tick ends every poll interval so that
+            # clients connecting during a long gap are accepted at once
+            batches = self._batches(TCP_CLIENT_POLL_INTERVAL)
+            while True:
+                # Wait for at least one client to be connected
+                waiting = time.perf_counter()
+                while not self.stopping:
+                    events = sel.select(timeout=0)
+                    for key, mask in events:
+                        if key.data is None:
+                            self._accept(key.fileobj)
+                    if self.subs.clients:
+                        break
+                    time.sleep(TCP_CLIENT_POLL_INTERVAL)  # Wait a bit before checking again
+                if self.startup is None:
+                    self.waited += time.perf_counter() - waiting
+
+                batch = next(batches, None)
+                if batch is None:
+                    return True
+
+                # Each group of clients with the same subscription shares
+                # one buffer holding its part of the tick, and the tick is
+                # written with one gathered send per client
+                for (buf, clients) in self.subs.ticks(batch):
+                    size = len(buf)
+                    for client in clients:
+                        client.outq.append(buf)
+                        client.queued += size
+                        key = sel.get_key(client.sock)
+                        try:
+                            flushClient(sel, key)
+                        except Exception as ex:
+                            self.errors += 1
+                            self.log("Error sending to client: %s" % ex)
+                            closeClient(sel, key)
+                    # End for
+                # End for
+                self.sent += len(batch)
+                self.bytes += sum(len(mess) for mess in batch)
+
+                # Service all connections (new clients, closed connections
+                # and any backlog left by a short write)
+                events = sel.select(timeout=0)
+                for key, mask in events:
+                    if key.data is None:
+                        self._accept(key.fileobj)
+                    else:
+                        try:
+                            service_connection(sel, key, mask, self.log)
+                        except Exception as ex:
+                            self.errors += 1
+                            self.log("Error servicing client: %s" % ex)
+                            closeClient(sel, key)
+        finally:
+            self.sel = None
+            for key in list(sel.get_map().values()):
+                try:
+                    sel.unregister(key.fileobj)
+                except Exception:
+                    pass
+                key.fileobj.close()
+            sel.close()
+            if control:
+                control.stop()
+    # End _tcp()
+
+    def _serial(self):
+        fd = False
+        slave = None
+        link = False
+        control = False
+        try:
+            self._open()
+            (fd, name, slave) = openSerial(self.Serial, self.Baud)
+            link = SerialLink(fd, self.Baud, self.SerialBuffer, self.Overflow)
+            if self.lines > 0:
+                self.log("Serial output on %s at %d baud, %s when more than "
+                         "%d bytes are waiting." % (name, self.Baud,
+                                                    self.Overflow,
+                                                    self.SerialBuffer))
+                self.sched.describe()
+            control = self._startControl()
+            overflows = 0
+            reported = 0.0
+            for batch in self._batches():
+                for mess in batch:
+                    if link.send(mess):
+                        self.sent += 1
+                        self.bytes += len(mess)
+                    else:
+                        self.dropped += 1
+                # End for
+                # Report saturation when it starts, and at most every
+                # SERIAL_REPORT_INTERVAL seconds while it lasts or keeps
+                # coming back; the counts are in link.summary()
+                now = time.monotonic()
+                if (link.saturated or link.overflows > overflows) and \
+                        now - reported >= SERIAL_REPORT_INTERVAL:
+                    self.log("Serial link %s at line %d, %d bytes (%.2f s) "
+                             "waiting." % ("saturated"
+                                           if link.overflows > overflows
+                                           else "still saturated",
+                                           self.sched.line, link.backlog,
+                                           link.lag()))
+                    overflows = link.overflows
+                    reported = now
+            # End for
+            # Let the link finish sending what is still waiting
+            while link.backlog and not self.stopping:
+                time.sleep(0.1)
+            return True
+        finally:
+            if control:
+                control.stop()
+            if link:
+                link.close()
+                self.log(link.summary())
+            if fd:
+                os.close(fd)
+            if slave is not None:
+                os.close(slave)
+    # End _serial()
+
+    def _shm(self):
+        ring = False
+        control = False
+        try:
+            self._open()
+            ring = SharedRing(self.Shm, self.ShmSize)
+            if self.lines > 0:
+                self.log("Shared memory ring %s, %d bytes." %
+                         (ring.path, ring.capacity))
+                self.sched.describe()
+            control = self._startControl()
+            for batch in self._batches():
+                sent = ring.bytes
+                written = ring.send(batch)
+                self.sent += written
+                self.dropped += len(batch) - written
+                self.bytes += ring.bytes - sent
+            # End for
+            return True
+        finally:
+            if control:
+                control.stop()
+            if ring:
+                ring.close()
+                self.log(ring.summary())
+    # End _shm()
+
+    def _origin(self):
+        """Output time of the start of the replay: the first timestamp of
+        the recording, moved as Retime asks"""
+        index = self.sched.index
+        first = None
+        if index is not None:
+            # The first entry is enough, long before the index is done
+            while len(index) == 0 and not index.done.wait(0.01):
+                pass
+            if len(index) > 0:
+                first = index.stamps[0]
+        # End if
+        if self.Retime == 'now' or (first is None and self.Retime is None):
+            return time.time()
+        if self.Retime == 'today':
+            if first is None:
+                return time.time() // 86400 * 86400
+            return first + (time.time() // 86400 - first // 86400) * 86400
+        if self.Retime is not None:
+            return self.Retime
+        return first
+    # End _origin()
+
+    def _file(self):
+        out = False
+        try:
+            self._open()
+            if hasattr(self.Output, 'write'):
+                out = self.Output
+                name = getattr(out, 'name', 'output')
+            else:
+                out = open(self.Output, 'wb')
+                name = self.Output
+            self.sched.describe()
+            origin = self._origin()
+            patterns = self.Subscribe
+            self.log("Writing %s starting at %s." % (
+                name, datetime.datetime.fromtimestamp(
+                    origin, datetime.timezone.utc).isoformat()))
+            chunks = []
+            size = 0
+            # One message at a time: nothing waits, so there are no ticks
+            # to gather
+            while True:
+                mess = self._nextMessage()
+                if not mess:
+                    break
+                if patterns is not None and \
+                        not isSubscribed(patterns, messageAddress(mess)):
+                    continue
+                mess = tagMessage(mess, origin + self.sched.now)
+                chunks.append(mess)
+                size += len(mess)
+                self.sent += 1
+                if size >= OUTPUT_CHUNK:
+                    out.write(b"".join(chunks))
+                    self.bytes += size
+                    chunks = []
+                    size = 0
+            # End while
+            out.write(b"".join(chunks))
+            self.bytes += size
+            self.log("Wrote %d sentences (%d bytes) in %.1f s, ending at %s."
+                     % (self.sent, self.bytes,
+                        time.perf_counter() - self.started,
+                        datetime.datetime.fromtimestamp(
+                            origin + self.sched.now,
+                            datetime.timezone.utc).isoformat()))
+            return True
+        finally:
+            if out:
+                if out is self.Output:
+                    out.flush()
+                else:
+                    out.close()
+    # End _file()
+
+    def _accept(self, Server):
+        # Take every connection that is waiting, so that a crowd of
+        # clients connecting at once does not overflow the backlog
+        for _ in range(TCP_LISTEN_BACKLOG):
+            try:
+                accept_wrapper(self.sel, Server, self.log, self.TcpNoDelay,
+                               self.TcpCork, self.subs, self.servers[Server])
+            except (BlockingIOError, InterruptedError):
+                break
+# End Player
+
+
+def formatLag(lag):
+    return '-' if lag is None else "%.1f ms" % (lag * 1000)
+
+
+def sendJson(sock, message):
+    sock.sendall((json.dumps(message) + "\n").encode('utf-8'))
+
+
+def readJson(link):
+    """Take the complete JSON lines received on a link so far"""
+    while b"\n" in link.inb:
+        line, link.inb = link.inb.split(b"\n", 1)
+        if line.strip():
+            yield json.loads(line.decode('utf-8'))
+
+
+class Worker:
+    """Plays jobs for a Coordinator (--worker).
+
+    Serves one coordinator at a time on a TCP port.  Both directions carry
+    one JSON object per line.  The worker opens with 'hello' and a nonce;
+    with a Secret the coordinator must first answer 'auth' with the
+    HMAC-SHA256 of the nonce.  The coordinator then sends 'play' with the
+    command line of a job, 'time' to probe the worker clock, 'start' with
+    the worker clock time to start all jobs at, and 'stop'.  The worker
+    answers each job with 'ready' or 'error', passes on its 'log' lines and
+    'stats' every WORKER_STATS_INTERVAL seconds, and sends 'done' with the
+    result once it has ended.
+
+    A job may only use WORKER_OPTIONS and play a file under Root.
+    """
+
+    def __init__(self, Host, Port, Root=None, Secret=None, log=print):
+        self.Root = os.path.realpath(Root or os.getcwd())
+        self.Secret = Secret
+        self.log = log
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+        self.server.bind((Host, Port))
+        self.server.listen(1)
+        self.lock = threading.Lock()    # Players report from their threads
+        self.conn = None
+        self.jobs = {}          # Job number -> options, then Player
+        self.done = set()
+
+    def serve(self):
+        """Serve one coordinator after another until interrupted"""
+        listening = self.server.getsockname()
+        self.log("Worker at address: " + str(listening[0]) +
+                 " is listening on port: " + str(listening[1]))
+        self.log("Playing files under %s%s." % (
+            self.Root, " for authenticated coordinators" if self.Secret
+            else ""))
+        try:
+            while True:
+                (conn, addr) = self.server.accept()
+                self.log("Coordinator %s:%d connected." % addr)
+                try:
+                    self._session(conn)
+                except (OSError, ValueError) as ex:
+                    self.log("Coordinator connection failed: %s" % ex)
+                finally:
+                    self._stopJobs()
+                    conn.close()
+                self.log("Coordinator %s:%d disconnected." % addr)
+        finally:
+            self._stopJobs()
+            self.server.close()
+    # End serve()
+
+    def send(self, **message):
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    sendJson(self.conn, message)
+                except OSError:
+                    pass    # The session notices when it reads next
+
+    def _session(self, conn):
+        link = types.SimpleNamespace(inb=b"", nonce=os.urandom(16).hex(),
+                                     trusted=self.Secret is None)
+        conn.settimeout(WORKER_STATS_INTERVAL)
+        with self.lock:
+            self.conn = conn
+        self.send(event='hello', nonce=link.nonce)
+        try:
+            while True:
+                try:
+                    data = conn.recv(4096)
+                    if not data:
+                        return
+                    link.inb += data
+                except socket.timeout:
+                    pass
+                if len(link.inb) > WORKER_MAX_LINE:
+                    raise ValueError("Command longer than %d bytes" %
+                                     WORKER_MAX_LINE)
+                for message in readJson(link):
+                    if not isinstance(message, dict):
+                        raise ValueError("Commands must be JSON objects")
+                    if link.trusted:
+                        self.command(message)
+                    else:
+                        self._authenticate(link, message)
+                for (job, player) in self.jobs.items():
+                    if isinstance(player, Player) and job not in self.done \
+                            and not player.running():
+                        self.done.add(job)
+                        self.send(event='done', job=job,
+                                  result=bool(player.result))
+                # End for
+        finally:
+            with self.lock:
+                self.conn = None
+    # End _session()
+
+    def _authenticate(self, link, message):
+        expected = hmac.new(self.Secret, link.nonce.encode('ascii'),
+                            hashlib.sha256).hexdigest()
+        mac = str(message.get('mac', ''))
+        if message.get('cmd') != 'auth' or not hmac.compare_digest(
+                mac.encode('utf-8'), expected.encode('ascii')):
+            self.send(event='error', message="Authentication failed")
+            raise ValueError("Authentication failed")
+        link.trusted = True
+
+    def jobOptions(self, args):
+        """Player keyword arguments for the command line of a job.  Raises
+        ValueError unless it only uses WORKER_OPTIONS and plays one file
+        under Root."""
+        if not isinstance(args, list) or \
+                not all(isinstance(arg, str) for arg in args):
+            raise ValueError("A job is a list of command line arguments")
+        try:
+            (options, files) = getopt.gnu_getopt(args, SHORT_OPTIONS,
+                                                 LONG_OPTIONS)
+            for (opt, arg) in options:
+                if opt not in WORKER_OPTIONS:
+                    raise ValueError("%s is not available to workers" % opt)
+            if len(files) != 1:
+                raise ValueError("A job plays one file")
+            options = parseArgs(args)
+        except getopt.GetoptError as ex:
+            raise ValueError(str(ex))
+        path = os.path.realpath(options['fName'])
+        if os.path.commonpath([path, self.Root]) != self.Root:
+            raise ValueError("%s is not under %s" % (options['fName'],
+                                                     self.Root))
+        if not os.path.isfile(path):
+            raise ValueError("No such file: " + options['fName'])
+        options['fName'] = path
+        return options
+    # End jobOptions()
+
+    def command(self, message):
+        cmd = message.get('cmd')
+        job = message.get('job')
+        if cmd == 'play':
+            try:
+                options = self.jobOptions(message.get('args'))
+            except ValueError as ex:
+                self.send(event='error', job=job, message=str(ex))
+                return
+            options['on_log'] = lambda text, job=job: \
+                self.send(event='log', job=job, message=text)
+            options['on_stats'] = lambda stats, job=job: \
+                self.send(event='stats', job=job, **stats)
+            options['progressInterval'] = WORKER_STATS_INTERVAL
+            self.jobs[job] = options
+            self.log("Job %s: %s" % (job, " ".join(message['args'])))
+            self.send(event='ready', job=job)
+        elif cmd == 'time':
+            self.send(event='time', time=time.time())
+        elif cmd == 'auth':
+            pass    # Already trusted, or no Secret needed
+        elif cmd == 'start':
+            at = message.get('at')
+            if not isinstance(at, (int, float)):
+                self.send(event='error', message="Bad start time")
+                return
+            for (job, options) in list(self.jobs.items()):
+                if isinstance(options, dict):
+                    options['StartAt'] = at
+                    self.jobs[job] = Player(**options)
+                    self.jobs[job].start()
+        elif cmd == 'stop':
+            for player in self.jobs.values():
+                if isinstance(player, Player):
+                    player.stop()
+        else:
+            self.send(event='error', job=job,
+                      message="Unknown command: %s" % cmd)
+    # End command()
+
+    def _stopJobs(self):
+        for player in self.jobs.values():
+            if isinstance(player, Player):
+                player.stop()
+                player.join(COORDINATOR_TIMEOUT)
+        self.jobs = {}
+        self.done = set()
+# End Worker
+
+
+class Coordinator:
+    """Plays recordings on several Workers at once (--coordinate).
+
+    A single recording is split into a Partition for every worker,
+    otherwise the recordings are dealt out to the workers in turn.  The
+    workers open the recordings themselves, so each must be found at the
+    same path on every node.  Every worker clock is probed so that all
+    jobs start at the same moment, and the throughput and lag of each job
+    are printed every COORDINATOR_REPORT seconds and once more at the end.
+    """
+
+    def __init__(self, Workers, fNames, Args=(), Secret=None, log=print):
+        self.Workers = Workers
+        self.fNames = fNames
+        self.Args = list(Args)
+        self.Secret = Secret
+        self.log = log
+        self.sel = selectors.DefaultSelector()
+        self.links = []
+        self.jobs = []
+        self.started = None
+
+    def run(self):
+        """Play every job.  Returns True when all of them ended normally."""
+        try:
+            self._connect()
+            self._prepare()
+            self._start()
+            self._follow()
+            return self._summary()
+        except KeyboardInterrupt:
+            self.log("\nStopping the workers.")
+            for link in self.links:
+                try:
+                    sendJson(link.sock, {'cmd': 'stop'})
+                except OSError:
+                    pass
+            try:
+                self._follow(time.monotonic() + COORDINATOR_TIMEOUT)
+            except (OSError, ValueError):
+                pass
+            self._summary()
+            raise
+        except (OSError, ValueError) as ex:
+            self.log("Error: %s" % ex)
+            return False
+        finally:
+            for link in self.links:
+                self.sel.unregister(link.sock)
+                link.sock.close()
+            self.links = []
+            self.sel.close()
+    # End run()
+
+    def _connect(self):
+        for (host, port) in self.Workers:
+            try:
+                sock = socket.create_connection((host, port),
+                                                COORDINATOR_TIMEOUT)
+            except OSError as ex:
+                raise ValueError("Can not reach worker %s:%d: %s" %
+                                 (host, port, ex))
+            link = types.SimpleNamespace(sock=sock, name="%s:%d" % (host, port),
+                                         inb=b"", offset=0.0, rtt=None)
+            self.links.append(link)
+            self.sel.register(sock, selectors.EVENT_READ, data=link)
+            hello = self._await(link, 'hello')
+            if self.Secret is not None:
+                sendJson(sock, {'cmd': 'auth', 'mac': hmac.new(
+                    self.Secret, str(hello['nonce']).encode('ascii'),
+                    hashlib.sha256).hexdigest()})
+            self._probe(link)
+            self.log("Worker %s connected, clock offset %+.1f ms "
+                     "(round trip %.1f ms)." % (link.name, link.offset * 1000,
+                                                link.rtt * 1000))
+    # End _connect()
+
+    def _probe(self, link):
+        """Estimate how far the worker clock is ahead of ours from the
+        answer with the shortest round trip"""
+        for _ in range(CLOCK_PROBES):
+            sent = time.time()
+            sendJson(link.sock, {'cmd': 'time'})
+            reply = self._await(link, 'time')
+            back = time.time()
+            if link.rtt is None or back - sent < link.rtt:
+                link.rtt = back - sent
+                link.offset = reply['time'] - (sent + back) / 2
+    # End _probe()
+
+    def _await(self, link, *events):
+        """Wait for the worker to send one of events and return it"""
+        deadline = time.monotonic() + COORDINATOR_TIMEOUT
+        while True:
+            for message in readJson(link):
+                if message.get('event') in events:
+                    return message
+                self._handle(link, message)
+            wait = deadline - time.monotonic()
+            if wait <= 0:
+                raise ValueError("Worker %s did not answer" % link.name)
+            self._receive(link, wait)
+    # End _await()
+
+    def _receive(self, link, timeout=None):
+        link.sock.settimeout(timeout)
+        try:
+            data = link.sock.recv(65536)
+        except socket.timeout:
+            return
+        if not data:
+            raise ValueError("Worker %s closed the connection" % link.name)
+        link.inb += data
+
+    def _prepare(self):
+        """Hand out the jobs and wait until every worker is ready"""
+        if len(self.fNames) == 1 and len(self.links) > 1:
+            plan = [(link, self.fNames[0], (i + 1, len(self.links)))
+                    for (i, link) in enumerate(self.links)]
+        else:
+            plan = [(self.links[i % len(self.links)], fName, None)
+                    for (i, fName) in enumerate(self.fNames)]
+        for (link, fName, part) in plan:
+            args = self.Args + [os.path.abspath(fName)]
+            label = "%s %s" % (link.name, os.path.basename(fName))
+            if part is not None:
+                args.insert(-1, "--partition=%d/%d" % part)
+                label += " %d/%d" % part
+            job = types.SimpleNamespace(number=len(self.jobs), link=link,
+                                        label=label, result=None, sent=0,
+                                        bytes=0, lag=None, maxLag=0.0,
+                                        line=0, lines=0, reported=0)
+            self.jobs.append(job)
+            sendJson(link.sock, {'cmd': 'play', 'job': job.number,
+                                 'args': args})
+        # End for
+        for job in self.jobs:
+            reply = self._await(job.link, 'ready', 'error')
+            if reply['event'] == 'error':
+                raise ValueError("%s: %s" % (job.label, reply['message']))
+    # End _prepare()
+
+    def _start(self):
+        at = time.time() + COORDINATOR_LEAD
+        for link in self.links:
+            sendJson(link.sock, {'cmd': 'start', 'at': at + link.offset})
+        self.started = time.monotonic() + COORDINATOR_LEAD
+        self.log("Playing %d jobs on %d workers from %s." % (
+            len(self.jobs), len(self.links),
+            time.strftime("%H:%M:%S", time.localtime(at))))
+
+    def _handle(self, link, message):
+        event = message.get('event')
+        job = message.get('job')
+        if not isinstance(job, int) or not (0 <= job < len(self.jobs)):
+            if event in ('log', 'error'):
+                self.log("[%s] %s" % (link.name, message['message']))
+            return
+        job = self.jobs[job]
+        if event == 'log':
+            if message['message'].strip():
+                self.log("[%s] %s" % (job.label, message['message'].strip()))
+        elif event == 'stats':
+            job.sent = message['sent']
+            job.bytes = message['bytes']
+            job.line = message['line']
+            job.lines = message['lines']
+            if message['lag'] is not None and message['state'] == 'playing':
+                job.lag = message['lag']
+                job.maxLag = max(job.maxLag, job.lag)
+        elif event == 'done':
+            job.result = message['result']
+        elif event == 'error':
+            self.log("[%s] Error: %s" % (job.label, message['message']))
+    # End _handle()
+
+    def _follow(self, until=None):
+        """Collect the progress of the jobs until all are done, or until
+        the monotonic time until"""
+        nextReport = time.monotonic() + COORDINATOR_REPORT
+        while any(job.result is None for job in self.jobs):
+            now = time.monotonic()
+            if until is not None and now >= until:
+                return
+            timeout = nextReport - now
+            if until is not None:
+                timeout = min(timeout, until - now)
+            for (key, mask) in self.sel.select(max(timeout, 0.0)):
+                self._receive(key.data)
+                for message in readJson(key.data):
+                    self._handle(key.data, message)
+            if until is None and time.monotonic() >= nextReport:
+                nextReport += COORDINATOR_REPORT
+                self._progress()
+        # End while
+    # End _follow()
+
+    def _progress(self):
+        total = 0
+        for job in self.jobs:
+            rate = (job.sent - job.reported) / COORDINATOR_REPORT
+            job.reported = job.sent
+            total += rate
+            self.log("%-32s sent %9d %8.0f/s  lag %s  line %d/%s" % (
+                job.label, job.sent, rate, formatLag(job.lag), job.line,
+                job.lines if job.lines < float('inf') else '?'))
+        self.log("%-32s %18.0f/s" % ("total", total))
+    # End _progress()
 
-# Global keep-alive instance
-keep_alive = SystemKeepAlive()
+    def _summary(self):
+        elapsed = max(time.monotonic() - (self.started or time.monotonic()),
+                      1e-6)
+        self.log("")
+        for job in self.jobs:
+            self.log("%-32s sent %9d %8.0f/s %8.2f MB/s  max lag %s  %s" % (
+                job.label, job.sent, job.sent / elapsed,
+                job.bytes / elapsed / 1e6, formatLag(job.maxLag),
+                {True: 'done', False: 'failed', None: 'stopped'}[job.result]))
+        sent = sum(job.sent for job in self.jobs)
+        bytes_ = sum(job.bytes for job in self.jobs)
+        self.log("%-32s sent %9d %8.0f/s %8.2f MB/s in %s" % (
+            "total", sent, sent / elapsed, bytes_ / elapsed / 1e6,
+            formatDuration(elapsed)))
+        return all(job.result for job in self.jobs)
+    # End _summary()
+# End Coordinator
 
-class percentComplete:
 
-    def __init__(self, tInc):
-        self.oldTime = time.perf_counter()
-        self.tInc = tInc
+def isMulticast(address):
+    try:
+        first = int(socket.gethostbyname(address).split('.')[0])
+    except (OSError, ValueError):
+        return False
+    return 224 <= first <= 239
 
-    def printPercent(self, percent):
-        newTime = time.perf_counter()
-        if (newTime - self.oldTime) > self.tInc:
-            print(" %3.1f percent complete...." % round(percent, 1), end='\r')
-            self.oldTime = newTime
 
+# Configure a UDP socket for sending to a multicast group.  One send then
+# reaches every host that has joined the group, up to ttl router hops away.
+def setMulticastOptions(sock, ttl=1, interface=None, loop=True):
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP,
+                    1 if loop else 0)
+    if interface:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                        socket.inet_aton(socket.gethostbyname(interface)))
+# End setMulticastOptions()
 
-# Count number of lines in a file
-def lineCount(f):
-    i = -1
-    for (i, l) in enumerate(f):
-        pass
-    f.seek(0)
-    return i + 1
 
+# Join a multicast group on a receiving UDP socket, for consumers and tests
+def joinMulticast(sock, group, interface=None):
+    mreq = socket.inet_aton(socket.gethostbyname(group)) + \
+        socket.inet_aton(socket.gethostbyname(interface) if interface
+                         else '0.0.0.0')
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+# End joinMulticast()
 
-def openFile(fName):
-    Len = float('inf')
-    if fName is not None:
-        try:
-            f = open(fName, 'r')
-            print("Playing file '%s', Type Ctrl-C to exit..." % fName)
-        except FileNotFoundError:
-            print("File '%s' not found, exiting." % fName)
-            sys.exit(1)
-        # End try
-        Len = lineCount(f)
-    else:
-        f = sys.stdin
-    # End if
-    return (f, Len)
-# End openFile()
 
+class TokenBucket:
+    """Lets rate units a second through on average, and up to burst at
+    once after a quiet period"""
 
-def getNextMessage(f, Delay, Speed):
-    if f:
-        mess = f.readline()
-    else:
-        print("End of file reached...")
-        return False
-    # End if
-    if len(mess) == 0:
-        return False
-    # End if
-    mess = mess.strip()
-    if Delay > 0:
-        delayMessage(mess, Delay, Speed)
-    mess = mess + u"\r\n"
-    return(mess.encode("utf-8"))
-# End getNextMessage()
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
 
+    def refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
 
-def delayMessage(mess, Delay, Speed):
-    global initialdelta
-    global starttime
+    def wait(self, n):
+        """Seconds until n units may pass.  Anything larger than the burst
+        passes once the bucket is full."""
+        return max(0.0, (min(n, self.burst) - self.tokens) / self.rate)
 
-    # Check if it is a NMEAv4 message with timestamp
-    try: 
-       messtime = int(mess.split("*")[0].split(":")[2])
-    except:
-        time.sleep(Delay)
-    else:
-        if initialdelta is None:
-            print("NMEAv4 timestamp found. Replaying logs at %3.2fx speed, instead of using delay." % Speed)
-            starttime = time.time()
-            initialdelta = starttime - messtime
-        ComputedDelay = messtime + initialdelta - Speed * time.time() + (Speed - 1 ) * starttime
-        if ComputedDelay > 60 :
-            print("Huge gap in file. Not waiting %d seconds." % ComputedDelay)
-            starttime = time.time()
-            initialdelta = starttime - messtime
-            ComputedDelay = 0 
-        if ComputedDelay > 0 :
-            time.sleep(ComputedDelay)
-# End getMessageTimestamp()
-
-
-def udp(Dest, Port, fName, Delay, Repeat, Speed):
-    if Dest is None:
-        Dest = socket.gethostbyname(socket.gethostname())
-    # End if
-    if Port is None:
-        Port = 10110
-    # End if
-    f = False
-    sock = False
+    def take(self, n):
+        self.tokens -= n
+# End TokenBucket
+
+
+class Shaper:
+    """Rate limit for one output.
+
+    Token buckets allow maxRate sentences and maxBytes bytes a second,
+    with bursts of up to burst seconds' worth.  Sentences over the limit
+    are queued and sent as soon as the buckets allow (overflow 'queue')
+    or dropped (overflow 'drop').  At most SHAPER_QUEUE_LIMIT sentences
+    wait; any more are dropped.
+    """
+
+    def __init__(self, maxRate=None, maxBytes=None, burst=1.0,
+                 overflow='queue'):
+        self.buckets = []       # (TokenBucket, counts bytes)
+        if maxRate:
+            self.buckets.append((TokenBucket(maxRate,
+                                             max(1.0, maxRate * burst)),
+                                 False))
+        if maxBytes:
+            self.buckets.append((TokenBucket(maxBytes,
+                                             max(1.0, maxBytes * burst)),
+                                 True))
+        self.overflow = overflow
+        self.queue = collections.deque()
+        self.shaped = 0         # Sentences that had to wait
+        self.dropped = 0
+
+    def _wait(self, mess):
+        return max([bucket.wait(len(mess) if isBytes else 1)
+                    for (bucket, isBytes) in self.buckets] + [0.0])
+
+    def _take(self, mess):
+        for (bucket, isBytes) in self.buckets:
+            bucket.take(len(mess) if isBytes else 1)
+
+    def _refill(self):
+        now = time.monotonic()
+        for (bucket, _) in self.buckets:
+            bucket.refill(now)
+        return now
+
+    def admit(self, batch):
+        """Offer the messages of a tick.  Returns the messages that may be
+        sent now, those queued earlier first."""
+        self._refill()
+        out = []
+        while self.queue and self._wait(self.queue[0]) <= 0:
+            mess = self.queue.popleft()
+            self._take(mess)
+            out.append(mess)
+        for mess in batch:
+            if not self.queue and self._wait(mess) <= 0:
+                self._take(mess)
+                out.append(mess)
+            elif self.overflow == 'drop' or \
+                    len(self.queue) >= SHAPER_QUEUE_LIMIT:
+                self.dropped += 1
+            else:
+                self.queue.append(mess)
+                self.shaped += 1
+        # End for
+        return out
+
+    def nextRelease(self):
+        """Monotonic time the first queued message may be sent, or None
+        when nothing is queued"""
+        if not self.queue:
+            return None
+        return self._refill() + self._wait(self.queue[0])
+
+    def summary(self):
+        return ("Rate limit: %d sentences delayed, %d dropped, %d still "
+                "queued." % (self.shaped, self.dropped, len(self.queue)))
+# End Shaper
+
+
+# Open a serial device for writing at baud, or a new pseudo-terminal when
+# device is 'pty'.  Returns (fd, name, slave fd) where the slave fd of a
+# pseudo-terminal is kept open so that writes succeed before a consumer
+# opens it.
+def openSerial(device, baud):
     try:
-        (f, len) = openFile(fName)
-        if len > 0:
-            print("  UDP target IP: " + Dest)
-            print("UDP target port: " + str(Port))
-            print("Inserting %3.2f mS delay between each message." %
-                  (Delay * 1000))
-        sock = socket.socket(socket.AF_INET,    # Internet
-                             socket.SOCK_DGRAM)  # UDP
-        # Allow UDP broadcast
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        # Add socket reuse for better cross-platform compatibility
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        
-        count = 0
-        pct = percentComplete(5.0)
-        consecutive_errors = 0
-        max_consecutive_errors = 5
-        
-        while True:
-            nextMessage = getNextMessage(f, Delay, Speed)
-            count = count + 1
-            pct.printPercent(count / len * 100)
-            if not nextMessage:
-                print("")
-                Repeat -= 1
-                if Repeat > 0:
-                    f.seek(0)
-                    count = 0
-                    oldTime = time.perf_counter()
-                    if Repeat > 1:
-                        print("Repeating file...%d more times." % Repeat)
-                    else:
-                        print("Repeating file...%d more time." % Repeat)
-                    continue
-                return True
-            # End if
-            
-            # Send next message to client with reasonable
-            # number of retries before giving up.
-            try:
-                sock.sendto(nextMessage, (Dest, Port))
-                consecutive_errors = 0  # Reset error counter on success
-            except socket.error as e:
-                consecutive_errors += 1
-                print(f"\nSocket error: {e} (attempt {consecutive_errors})")
-                if consecutive_errors >= max_consecutive_errors:
-                    print("Too many consecutive socket errors, exiting...")
+        import termios
+        import tty
+    except ImportError:
+        raise OSError("Serial output needs a POSIX system (Linux or macOS)")
+    if device == 'pty':
+        (fd, slave) = os.openpty()
+        tty.setraw(slave)   # No echo or newline translation
+        return fd, os.ttyname(slave), slave
+    fd = os.open(device, os.O_WRONLY | os.O_NOCTTY)
+    try:
+        tty.setraw(fd)
+        speed = getattr(termios, 'B%d' % baud, None)
+        if speed is not None:
+            attrs = termios.tcgetattr(fd)
+            attrs[4] = attrs[5] = speed
+            termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    except termios.error:
+        pass    # Not a terminal, e.g. a FIFO used for testing
+    return fd, device, None
+# End openSerial()
+
+
+class SerialLink:
+    """Writes messages to a file descriptor at the pace of a serial line.
+
+    Bytes leave at the rate an 8N1 line at baud carries them, ten bits a
+    byte.  send() never blocks: messages wait in a queue for the writer
+    thread.  When more than bufferSize bytes are already waiting, which is
+    when the recording is more than the link could carry, a message is
+    still queued with overflow 'queue' (the link falls behind the
+    recording) or dropped with overflow 'drop'.  The link counts as
+    saturated from then until everything waiting has been written.
+    """
+
+    def __init__(self, fd, baud=4800, bufferSize=1024, overflow='queue'):
+        if overflow not in ('queue', 'drop'):
+            raise ValueError("Overflow policy must be queue or drop")
+        self.fd = fd
+        self.baud = baud
+        self.byteTime = 10.0 / baud
+        self.chunk = max(1, baud // 1000)   # About 10 ms of data a write
+        self.bufferSize = bufferSize
+        self.overflow = overflow
+        self.queue = collections.deque()
+        self.backlog = 0        # Bytes queued and not yet written
+        self.peakBacklog = 0
+        self.sent = 0
+        self.dropped = 0
+        self.droppedBytes = 0
+        self.overflows = 0      # Times the link became saturated
+        self.saturated = False
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def lag(self):
+        """Seconds the link needs to send what is waiting"""
+        return self.backlog * self.byteTime
+
+    def send(self, mess):
+        """Queue mess.  Returns False if it was dropped."""
+        with self.cond:
+            if self.backlog and self.backlog + len(mess) > self.bufferSize:
+                if not self.saturated:
+                    self.saturated = True
+                    self.overflows += 1
+                if self.overflow == 'drop':
+                    self.dropped += 1
+                    self.droppedBytes += len(mess)
                     return False
-                # Brief pause before retry
-                time.sleep(0.1)
+            self.queue.append(mess)
+            self.backlog += len(mess)
+            self.peakBacklog = max(self.peakBacklog, self.backlog)
+            self.cond.notify()
+        return True
+
+    def run(self):
+        due = time.monotonic()
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                mess = memoryview(self.queue.popleft())
+            due = max(due, time.monotonic())
+            while mess and not self.closed:
+                n = os.write(self.fd, mess[:self.chunk])
+                mess = mess[n:]
+                with self.cond:
+                    self.backlog -= n
+                    if not self.backlog:
+                        self.saturated = False  # Caught up
+                due += n * self.byteTime
+                wait = due - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            # End while
+            self.sent += 1
+    # End run()
+
+    def close(self):
+        """Stop writing, abandoning anything still queued"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(1.0)
+
+    def summary(self):
+        return ("Serial link: %d sentences written, %d dropped (%d bytes), "
+                "saturated %d times, peak backlog %d bytes (%.2f s)." %
+                (self.sent, self.dropped, self.droppedBytes, self.overflows,
+                 self.peakBacklog, self.peakBacklog * self.byteTime))
+# End SerialLink
+
+
+# Path of the file backing ring name.  Names without a directory are put in
+# /dev/shm where it exists, so the ring never touches a disk.
+def ringPath(name):
+    if os.path.dirname(name):
+        return name
+    if os.path.isdir('/dev/shm'):
+        return os.path.join('/dev/shm', name)
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), name)
+# End ringPath()
+
+
+class SharedRing:
+    """Publishes messages into a ring buffer in a memory mapped file for
+    readers on the same host (see RingReader).
+
+    A tick is copied into the ring and then published with a single
+    update of the header, so readers see whole ticks and never wait for
+    the writer.  The writer never waits for readers either: a reader that
+    falls more than the ring behind loses the oldest sentences.  A ring
+    left by an earlier run is marked closed and replaced, but any other
+    file at the path is refused.
+    """
+
+    def __init__(self, name, size=RING_SIZE):
+        if size < 4096:
+            raise ValueError("Ring size must be at least 4096 bytes")
+        size -= size % 4
+        self.path = ringPath(name)
+        self.capacity = size
+        self.slack = size // 4  # Most bytes written before a publish
+        self.seq = 0
+        self.head = 0
+        self.published = 0
+        self.bytes = 0          # Message bytes, without lengths and padding
+        self.dropped = 0        # Sentences too long for the ring
+        self._retire()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC |
+                     getattr(os, 'O_NOFOLLOW', 0), 0o644)
+        try:
+            os.ftruncate(fd, RING_HEADER + size)
+            self.map = mmap.mmap(fd, RING_HEADER + size)
+        finally:
+            os.close(fd)
+        self.data = memoryview(self.map)[RING_HEADER:]
+        _ringHeader.pack_into(self.map, 0, RING_MAGIC, RING_VERSION, size,
+                              0, 0, RING_OPEN, 0)
+        struct.pack_into('<d', self.map, 40, time.time())
+
+    def _retire(self):
+        # Tell readers of a ring left by an earlier run that it has ended.
+        # Only a regular file that starts like a ring is ever replaced.
+        try:
+            mode = os.lstat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISREG(mode):
+            raise ValueError("%s exists and is not a shared memory ring" %
+                             self.path)
+        with open(self.path, 'r+b') as old:
+            header = old.read(RING_HEADER)
+            if len(header) < RING_HEADER or header[:4] != RING_MAGIC:
+                raise ValueError("%s exists and is not a shared memory "
+                                 "ring" % self.path)
+            old.seek(RING_STATE)
+            old.write(_ringLength.pack(RING_CLOSED))
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass    # Still mapped on Windows
+
+    def send(self, batch):
+        """Copy the messages of one tick into the ring and publish them.
+        Returns the number of messages written."""
+        data = self.data
+        capacity = self.capacity
+        head = self.head
+        written = 0
+        for mess in batch:
+            n = len(mess)
+            need = (4 + n + 3) & ~3
+            if need > self.slack:
+                self.dropped += 1
+                continue
+            pos = head % capacity
+            if capacity - pos < need:
+                if capacity - pos >= 4:
+                    _ringLength.pack_into(data, pos, RING_WRAP)
+                head += capacity - pos
+                pos = 0
+            if head + need - self.published > self.slack:
+                self._publish(head)
+            _ringLength.pack_into(data, pos, n)
+            data[pos + 4:pos + 4 + n] = mess
+            head += need
+            self.seq += 1
+            self.bytes += n
+            written += 1
+        # End for
+        self._publish(head)
+        return written
+
+    def _publish(self, head):
+        self.head = head
+        self.published = head
+        _ringSeq.pack_into(self.map, RING_SEQ, self.seq, head)
+
+    def close(self):
+        """Mark the ring closed so that readers know no more will come"""
+        if self.map is not None:
+            _ringLength.pack_into(self.map, RING_STATE, RING_CLOSED)
+            self.data.release()
+            self.map.close()
+            self.map = None
+
+    def summary(self):
+        return ("Shared memory ring %s: %d sentences, %d bytes published" %
+                (self.path, self.seq, self.bytes) +
+                (", %d too long." % self.dropped if self.dropped else "."))
+# End SharedRing
+
+
+class RingReader:
+    """Reads the messages a SharedRing publishes, from any process on the
+    same host:
+
+        reader = RingReader('vdr')
+        while not reader.closed:
+            for mess in reader.read(timeout=1.0):
+                ...
+
+    Reading only touches the shared memory; there is no system call per
+    sentence, and none at all while messages keep arriving.  Reading starts
+    at the newest message.  lost counts the messages overwritten before
+    they could be read.
+    """
+
+    def __init__(self, name):
+        self.path = ringPath(name)
+        with open(self.path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.capacity, self.seq, self.pos, state,
+         _) = _ringHeader.unpack_from(self.map, 0)
+        if magic != RING_MAGIC or version != RING_VERSION:
+            self.map.close()
+            raise ValueError("%s is not a VDRplayer ring" % self.path)
+        self.slack = self.capacity // 4
+        self.data = memoryview(self.map)[RING_HEADER:]
+        self.lost = 0
+
+    @property
+    def closed(self):
+        """True once the writer has closed the ring and all of it is read"""
+        return (_ringLength.unpack_from(self.map, RING_STATE)[0] == RING_CLOSED
+                and _ringSeq.unpack_from(self.map, RING_SEQ)[1] == self.pos)
+
+    def read(self, timeout=0.0):
+        """List of the messages published since the last call.  Waits up to
+        timeout seconds for one to arrive, returning [] if none does."""
+        (seq, head) = _ringSeq.unpack_from(self.map, RING_SEQ)
+        if head == self.pos and timeout:
+            deadline = time.monotonic() + timeout
+            while head == self.pos and time.monotonic() < deadline:
+                if _ringLength.unpack_from(self.map, RING_STATE)[0] != \
+                        RING_OPEN:
+                    break
+                time.sleep(RING_POLL)
+                (seq, head) = _ringSeq.unpack_from(self.map, RING_SEQ)
+        # End if
+        data = self.data
+        capacity = self.capacity
+        pos = self.pos
+        if head - pos > capacity - self.slack:
+            return self._overrun(seq, head)
+        out = []
+        while pos < head:
+            offset = pos % capacity
+            if capacity - offset < 4:
+                pos += capacity - offset
+                continue
+            n = _ringLength.unpack_from(data, offset)[0]
+            if n == RING_WRAP:
+                pos += capacity - offset
                 continue
+            out.append(bytes(data[offset + 4:offset + 4 + n]))
+            pos += (4 + n + 3) & ~3
         # End while
+        # The writer may have gone round the ring while this was copied
+        (seq2, head2) = _ringSeq.unpack_from(self.map, RING_SEQ)
+        if head2 - self.pos > capacity - self.slack:
+            return self._overrun(seq2, head2)
+        self.pos = pos
+        self.seq += len(out)
+        return out
+
+    def _overrun(self, seq, head):
+        # Skip to the newest message, counting the ones that were lost
+        self.lost += seq - self.seq
+        self.seq = seq
+        self.pos = head
+        return []
+
+    def close(self):
+        self.data.release()
+        self.map.close()
+# End RingReader
+
+
+def udp(Dest, Port, fName, Delay, Repeat, Speed, Gap=None, Control=None):
+    player = Player(fName, 'UDP', Dest=Dest, Port=Port, Delay=Delay,
+                    Repeat=Repeat, Speed=Speed, Gap=Gap, Control=Control)
+    try:
+        return player.run()
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt.")
         return True
     # End except KeyboardInterrupt
+# End udp()
 
-    except Exception as ex:
-        print("Exception...")
-        print(ex)
-        raise ex
-    # End except Exception
 
-    finally:
-        if sock:
-            sock.close()
-        if f:
-            f.close()
-        # End if
-    # End try
-# End udp()
+class TcpClient:
+    """State of one TCP client.  Slots keep it small, as one player may
+    serve thousands of clients.
 
+    outq holds the tick buffers still to be sent, shared with every other
+    client of the same subscription, and offset is how much of the first
+    one has been sent already.
+    """
+    __slots__ = ('sock', 'addr', 'outq', 'offset', 'queued', 'cork', 'inb',
+                 'subs', 'patterns')
 
-# Now we create the TCP version.
-# It's more complex because we want to
-# accept multiple client connections
-# simultaneously.
+    def __init__(self, sock, addr, cork=False, subs=None, patterns=None):
+        self.sock = sock
+        self.addr = addr
+        self.outq = collections.deque()
+        self.offset = 0
+        self.queued = 0
+        self.cork = cork
+        self.inb = b""
+        self.subs = subs
+        self.patterns = patterns
+# End TcpClient
 
-sel = selectors.DefaultSelector()
 
+# Raise the limit on open files as far as the system allows, since every
+# TCP client takes a file descriptor
+def raiseFileLimit():
+    try:
+        import resource
+    except ImportError:
+        return      # Windows
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+# End raiseFileLimit()
 
-def accept_wrapper(sock):
+
+def accept_wrapper(sel, sock, log=print, noDelay=True, cork=False, subs=None,
+                   patterns=None):
     conn, addr = sock.accept()
     conn.setblocking(False)
-    client_data = types.SimpleNamespace(addr=addr, outb=b"")
-    events = selectors.EVENT_READ | selectors.EVENT_WRITE
-    sel.register(conn, events, data=client_data)
-    print(f"Accepted connection from client: {client_data.addr}")
+    try:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                        1 if noDelay else 0)
+        if cork:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+    except (AttributeError, OSError):
+        cork = False    # TCP_CORK is Linux only
+    client_data = TcpClient(conn, addr, cork, subs, patterns)
+    sel.register(conn, selectors.EVENT_READ, data=client_data)
+    if subs is not None:
+        subs.add(client_data)
+    log(f"Accepted connection from client: {client_data.addr}")
 # End accept_wrapper()
 
 
-def service_connection(key, mask):
+def closeClient(sel, key):
+    if getattr(key.data, 'subs', None) is not None:
+        key.data.subs.remove(key.data)
+    try:
+        sel.unregister(key.fileobj)
+    except Exception:
+        pass
+    key.fileobj.close()
+# End closeClient()
+
+
+# Write as much of a client's queue as the socket takes.  The queued
+# tick buffers go to the kernel as a list in a single sendmsg() call, so
+# catching up after a slow spell costs one system call.  A short write only
+# moves the client's offset into the first buffer, which other clients
+# share, so nothing is ever copied.
+def flushClient(sel, key):
+    sock = key.fileobj
+    data = key.data
+    outq = data.outq
+    if outq:
+        if data.offset:
+            bufs = [memoryview(outq[0])[data.offset:]]
+            bufs.extend(itertools.islice(outq, 1, MAX_SEND_BUFFERS))
+        elif len(outq) <= MAX_SEND_BUFFERS:
+            bufs = outq
+        else:
+            bufs = list(itertools.islice(outq, MAX_SEND_BUFFERS))
+        try:
+            if hasattr(sock, 'sendmsg'):
+                sent = sock.sendmsg(bufs)
+            else:   # Windows has no sendmsg()
+                sent = sock.send(b"".join(bufs))
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        data.queued -= sent
+        sent += data.offset
+        while outq and sent >= len(outq[0]):
+            sent -= len(outq[0])
+            outq.popleft()
+        data.offset = sent
+        if data.cork and not data.outq:
+            # Uncorking pushes out the partial segment held back
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+    # End if
+
+    # Only ask for write readiness while there is a backlog
+    events = selectors.EVENT_READ
+    if data.outq:
+        events |= selectors.EVENT_WRITE
+    if events != key.events:
+        sel.modify(sock, events, data=data)
+# End flushClient()
+
+
+def service_connection(sel, key, mask, log=print):
     sock = key.fileobj
     data = key.data
     if mask & selectors.EVENT_READ:
         recv_data = sock.recv(1024)  # Should be ready to read
-        print(str(len(recv_data)) + " characters received...")
         if not recv_data:
-            print("Closing connection to client:", sock)
-            sel.unregister(sock)
-            sock.close()
+            log("Closing connection to client: %s" % (data.addr,))
+            closeClient(sel, key)
             return False
         # End if
+        lines = (data.inb + recv_data).split(b"\n")
+        data.inb = lines.pop()[-1024:]
+        for line in lines:
+            clientCommand(data, line, log)
     # End if
     if mask & selectors.EVENT_WRITE:
-        if data.outb:
-            sent = sock.send(data.outb)  # Should be ready to write
-            data.outb = data.outb[sent:]
-        # End if
+        flushClient(sel, sel.get_key(sock))
     # End if
-
-    # Dynamically update selector events based on outb
-    events = selectors.EVENT_READ
-    if data.outb:
-        events |= selectors.EVENT_WRITE
-    try:
-        sel.modify(sock, events, data=data)
-    except Exception:
-        pass
-
     return True
 # End service_connection()
 
 
-def tcp(Host, Port, fName, Delay, Repeat, Speed):
-    if Host is None:
-        Host = socket.gethostbyname(socket.gethostname())
-    Host = socket.gethostbyname(Host)
-    if Port is None:
-        Port = 2947
-    f = False
-    Server = False
+# A TCP client may send "subscribe PATTERN,..." at any time to choose the
+# sentences it receives ("subscribe *" for all of them).  Anything else a
+# client sends is ignored.
+def clientCommand(data, line, log=print):
+    words = line.decode('ascii', 'replace').split(None, 1)
+    if not words or words[0].lower() != 'subscribe' or data.subs is None:
+        return
     try:
-        server_address = (Host, Port)
-        Server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        Server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
-        
-        # Add TCP keep-alive for better connection stability across platforms
-        Server.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-        
-        # Platform-specific TCP keep-alive settings (where supported)
-        try:
-            if platform.system() != 'Windows':  # Unix-like systems
-                Server.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 1)
-                Server.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 3)
-                Server.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 5)
-        except (AttributeError, OSError):
-            pass  # Not all systems support these options
-            
-        Server.bind(server_address)
-        Server.listen(5)
-        listening = Server.getsockname()
-        Server.setblocking(False)
-        sel.register(Server, selectors.EVENT_READ, data=None)
-        (f, length) = openFile(fName)
-        if length > 0:
-            print("Server at address: " + str(listening[0]) +
-                  " is listening on port: " + str(listening[1]))
-        count = 0
-        pct = percentComplete(5.0)
-        while True:
-            # Wait for at least one client to be connected
-            while True:
-                events = sel.select(timeout=0)
-                for key, mask in events:
-                    if key.data is None:
-                        accept_wrapper(key.fileobj)
-                # Wait until at least one client connection is established
-                # This checks if any registered socket has associated client data (i.e., is a client connection)
-                if any(key.data is not None for key in sel.get_map().values()):
-                    break
-                time.sleep(TCP_CLIENT_POLL_INTERVAL)  # Wait a bit before checking again
+        patterns = parseSubscription(words[1] if len(words) > 1 else '*')
+    except ValueError as ex:
+        log("Client %s: %s" % (data.addr, ex))
+        return
+    data.subs.subscribe(data, patterns)
+    log("Client %s subscribed to %s" % (data.addr,
+                                        formatSubscription(patterns)))
+# End clientCommand()
 
-            mess = getNextMessage(f, Delay, Speed)
-            count += 1
-            pct.printPercent(count / length * 100)
-            if not mess:
-                print("")
-                Repeat -= 1
-                if Repeat > 0:
-                    f.seek(0)
-                    count = 0
-                    if Repeat > 1:
-                        print("Repeating file...%d more times." % Repeat)
+
+# Longest subscription pattern accepted.  Standard addresses have five
+# characters; the rest is room for proprietary ones.
+SUBSCRIPTION_TYPE_WIDTH = 8
+
+
+# Subscription patterns are sentence addresses such as AIVDM or GPRMC, or
+# sentence formatters such as RMC (also written --RMC) that match any
+# talker.  A leading $ or ! is ignored.  None subscribes to everything.
+def parseSubscription(spec):
+    patterns = set()
+    for pattern in spec.replace(' ', ',').split(','):
+        pattern = pattern.strip().lstrip('$!').upper()
+        if pattern.startswith('--'):
+            pattern = pattern[2:]
+        if pattern == '*':
+            return None
+        if not pattern:
+            continue
+        if not pattern.isalnum() or len(pattern) > SUBSCRIPTION_TYPE_WIDTH:
+            raise ValueError("'%s' is not a sentence type" % pattern)
+        patterns.add(pattern.encode('ascii'))
+    # End for
+    return frozenset(patterns) if patterns else None
+# End parseSubscription()
+
+
+def formatSubscription(patterns):
+    if patterns is None:
+        return '*'
+    return ','.join(sorted(p.decode('ascii') for p in patterns))
+
+
+def isSubscribed(patterns, address):
+    return (patterns is None or address in patterns or
+            (len(address) == 5 and address[2:] in patterns))
+
+
+# Sentence address of a message as sent, after any tag block
+def messageAddress(mess):
+    if mess[:1] == b"\\":
+        end = mess.find(b"\\", 1)
+        mess = mess[end + 1:] if end > 0 else b""
+    if mess[:1] not in (b"$", b"!"):
+        return b""
+    return sentenceAddress(mess.rstrip())
+# End messageAddress()
+
+
+class Subscriptions:
+    """Which TCP clients receive which sentences.
+
+    Clients are grouped by subscription.  Each tick is filtered and joined
+    once per group, however many clients the group holds, and all of them
+    queue the same buffer.  A table maps each sentence address to the
+    filtered groups subscribed to it, so a message costs one lookup
+    however many groups there are.  The table is filled in as addresses
+    are first seen and cleared whenever a group is created or removed.
+    """
+
+    def __init__(self):
+        self.clients = {}       # Client -> None, in connection order
+        self.groups = {}        # Patterns -> {client: None}
+        self.table = {}         # Address -> patterns of filtered groups
+
+    def add(self, client):
+        self.clients[client] = None
+        if client.patterns not in self.groups:
+            self.groups[client.patterns] = {}
+            self.table.clear()
+        self.groups[client.patterns][client] = None
+
+    def remove(self, client):
+        if self.clients.pop(client, False) is None:
+            group = self.groups[client.patterns]
+            del group[client]
+            if not group:
+                del self.groups[client.patterns]
+                self.table.clear()
+
+    def subscribe(self, client, patterns):
+        self.remove(client)
+        client.patterns = patterns
+        self.add(client)
+
+    def subscribers(self, address):
+        """Patterns of the filtered groups that receive address"""
+        groups = self.table.get(address)
+        if groups is None:
+            groups = self.table[address] = tuple(
+                patterns for patterns in self.groups
+                if patterns is not None and isSubscribed(patterns, address))
+        return groups
+
+    def ticks(self, batch):
+        """(buffer, clients) for every group with sentences in batch"""
+        parts = {}
+        if None in self.groups:
+            parts[None] = batch
+        if len(self.groups) > len(parts):
+            table = self.table
+            for mess in batch:
+                address = messageAddress(mess)
+                groups = table.get(address)
+                if groups is None:
+                    groups = self.subscribers(address)
+                for patterns in groups:
+                    if patterns in parts:
+                        parts[patterns].append(mess)
                     else:
-                        print("Repeating file...%d more time." % Repeat)
-                    continue
-                else:
-                    return True
+                        parts[patterns] = [mess]
+            # End for
+        # End if
+        for (patterns, messages) in parts.items():
+            clients = self.groups.get(patterns)
+            if clients:
+                yield b"".join(messages), list(clients)
+    # End ticks()
+# End Subscriptions
 
-            # Send message to all connected clients
-            for key in list(sel.get_map().values()):
-                if key.data is not None:
-                    try:
-                        key.data.outb += mess
-                        sel.modify(key.fileobj, selectors.EVENT_READ | selectors.EVENT_WRITE, data=key.data)
-                    except Exception as ex:
-                        print("Error updating client:", ex)
-                        try:
-                            sel.unregister(key.fileobj)
-                        except Exception:
-                            pass
-                        key.fileobj.close()
-
-            # Service all connections (send data if needed)
-            events = sel.select(timeout=0)
-            for key, mask in events:
-                if key.data is not None:
-                    try:
-                        service_connection(key, mask)
-                    except Exception as ex:
-                        print("Error servicing client:", ex)
-                        try:
-                            sel.unregister(key.fileobj)
-                        except Exception:
-                            pass
-                        key.fileobj.close()
+
+def tcp(Host, Port, fName, Delay, Repeat, Speed, Gap=None, Control=None):
+    player = Player(fName, 'TCP', Host=Host, Port=Port, Delay=Delay,
+                    Repeat=Repeat, Speed=Speed, Gap=Gap, Control=Control)
+    try:
+        return player.run()
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt.")
         return True
-    except Exception as ex:
-        print("Exception...")
-        print(ex)
-        raise ex
-    finally:
-        for key in list(sel.get_map().values()):
-            if key.data is not None:
-                try:
-                    sel.unregister(key.fileobj)
-                except Exception:
-                    pass
-                key.fileobj.close()
-        if Server:
-            Server.close()
-        if f:
-            f.close()
 # End tcp()
 
 
+# Recording analysis.  analyzeFile() makes one streaming pass over a file
+# in large chunks, using NumPy for the per-line work when it is installed.
+
+ANALYZE_CHUNK_SIZE = 8 * 1024 * 1024
+ANALYZE_TYPE_WIDTH = 8      # Longest sentence address counted in full
+ANALYZE_MAX_LISTED = 100    # Gaps and bad lines listed in the report
+
+# Value of each byte as a hexadecimal digit, -1 if it is not one
+HEX_VALUES = [-1] * 256
+for (_i, _c) in enumerate(b"0123456789ABCDEF"):
+    HEX_VALUES[_c] = HEX_VALUES[ord(chr(_c).lower())] = _i
+
+
+# Sentence address (e.g. 'GPRMC') and talker (e.g. 'GP', or 'P' for
+# proprietary sentences) of a message without its tag block
+def sentenceAddress(mess):
+    end = len(mess)
+    for sep in (b",", b"*"):
+        i = mess.find(sep, 1)
+        if 0 < i < end:
+            end = i
+    return mess[1:min(end, 1 + ANALYZE_TYPE_WIDTH)]
+
+
+def talkerOf(address):
+    return address[:1] if address[:1] == b"P" else address[:2]
+
+
+class RecordingAnalysis:
+    """Statistics gathered in a single streaming pass over a recording"""
+
+    def __init__(self, bucket=60.0, threshold=60.0):
+        self.bucket = bucket
+        self.threshold = threshold
+        self.lines = 0
+        self.bytes = 0
+        self.sentences = 0
+        self.types = collections.Counter()
+        self.talkers = collections.Counter()
+        self.rates = collections.defaultdict(collections.Counter)
+        self.checksumOk = 0
+        self.checksumMissing = 0
+        self.badChecksums = collections.Counter()
+        self.badLines = []
+        self.timestamped = 0
+        self.firstTs = None
+        self.lastTs = None
+        self.backwards = 0
+        self.gapCount = 0
+        self.gapTotal = 0.0
+        self.gapLongest = 0.0
+        self.gaps = []
+        self.partial = b""
+
+    def feed(self, data):
+        """Add the next block of the file; lines may span blocks"""
+        self.bytes += len(data)
+        data = self.partial + data
+        end = data.rfind(b"\n") + 1
+        self.partial = data[end:]
+        if end:
+            self.addChunk(data[:end])
+
+    def finish(self):
+        if self.partial:
+            self.addChunk(self.partial + b"\n")
+            self.partial = b""
+
+    def addChunk(self, chunk):
+        """Add a block of complete, newline terminated lines"""
+        if loadNumpy() is not None:
+            self._addChunkNumpy(chunk)
+        else:
+            for line in chunk.split(b"\n")[:-1]:
+                self.addLine(line)
+
+    def _addTimestamp(self, ts, lineno):
+        self.timestamped += 1
+        if self.firstTs is None:
+            self.firstTs = ts
+        elif ts < self.lastTs:
+            self.backwards += 1
+        elif ts - self.lastTs > self.threshold:
+            dt = ts - self.lastTs
+            self.gapCount += 1
+            self.gapTotal += dt
+            self.gapLongest = max(self.gapLongest, dt)
+            if len(self.gaps) < ANALYZE_MAX_LISTED:
+                self.gaps.append({'line': lineno,
+                                  'at': round(self.lastTs - self.firstTs, 3),
+                                  'duration': round(dt, 3)})
+        self.lastTs = ts
+
+    def _addBad(self, address, lineno):
+        self.badChecksums[address] += 1
+        if len(self.badLines) < ANALYZE_MAX_LISTED:
+            self.badLines.append(lineno)
+
+    def addLine(self, line):
+        """Pure Python version of the per-line analysis"""
+        self.lines += 1
+        line = line.rstrip(b"\r")
+        if line[:1] == b"\\":
+            ts = getTimestamp(line)
+            if ts is not None:
+                self._addTimestamp(ts, self.lines)
+        start = min((i for i in (line.find(b"$"), line.find(b"!")) if i >= 0),
+                    default=-1)
+        if start < 0:
+            return
+        mess = line[start:]
+        self.sentences += 1
+        address = sentenceAddress(mess)
+        talker = talkerOf(address).decode("ascii", "replace")
+        address = address.decode("ascii", "replace")
+        self.types[address] += 1
+        self.talkers[talker] += 1
+        if self.lastTs is not None:
+            self.rates[talker][int((self.lastTs - self.firstTs) // self.bucket)] += 1
+        star = mess.rfind(b"*")
+        if star < 0 or len(mess) < star + 3:
+            self.checksumMissing += 1
+            return
+        computed = 0
+        for c in mess[1:star]:
+            computed ^= c
+        hi = HEX_VALUES[mess[star + 1]]
+        lo = HEX_VALUES[mess[star + 2]]
+        if hi >= 0 and lo >= 0 and hi * 16 + lo == computed:
+            self.checksumOk += 1
+        else:
+            self._addBad(address, self.lines)
+    # End addLine()
+
+    def _addChunkNumpy(self, chunk):
+        """Vectorised version of addLine() for a block of lines"""
+        arr = numpy.frombuffer(chunk, dtype=numpy.uint8)
+        prevTs = self.lastTs
+        ends = numpy.flatnonzero(arr == 10)
+        starts = numpy.concatenate(([0], ends[:-1] + 1))
+        ends = ends - ((ends > starts) & (arr[ends - 1] == 13))
+        lineno = self.lines + 1 + numpy.arange(len(ends))
+        self.lines += len(ends)
+
+        # Timestamps, forward filled so every line knows the latest one
+        lineTs = numpy.full(len(ends), numpy.nan)
+        for i in numpy.flatnonzero(arr[numpy.minimum(starts, len(arr) - 1)] == 92):
+            ts = getTimestamp(chunk[starts[i]:ends[i]])
+            if ts is not None:
+                self._addTimestamp(ts, int(lineno[i]))
+                lineTs[i] = ts
+        if self.timestamped:
+            known = numpy.where(numpy.isnan(lineTs), 0, numpy.arange(len(ends)))
+            known = numpy.maximum.accumulate(known)
+            filled = lineTs[known]
+            # Lines before the first timestamp in this chunk use the last
+            # timestamp before it (if any)
+            if prevTs is not None:
+                filled[numpy.isnan(filled)] = prevTs
+        else:
+            filled = lineTs
+
+        # Start of each sentence and its checksum delimiter
+        markers = numpy.flatnonzero((arr == 36) | (arr == 33))
+        if len(markers) == 0:
+            return
+        first = numpy.searchsorted(markers, starts)
+        mark = markers[numpy.minimum(first, len(markers) - 1)]
+        hasMark = (first < len(markers)) & (mark < ends)
+        mark, ends, lineno, filled = mark[hasMark], ends[hasMark], \
+            lineno[hasMark], filled[hasMark]
+        self.sentences += len(mark)
+
+        # Sentence addresses as fixed width byte strings
+        cols = mark[:, None] + 1 + numpy.arange(ANALYZE_TYPE_WIDTH)
+        addr = arr[numpy.minimum(cols, len(arr) - 1)].copy()
+        stop = (addr == 44) | (addr == 42) | (cols >= ends[:, None])
+        addr[numpy.maximum.accumulate(stop, axis=1)] = 0
+        addr = addr.view('S%d' % ANALYZE_TYPE_WIDTH).ravel()
+        types, typeIdx, typeCounts = numpy.unique(addr, return_inverse=True,
+                                                  return_counts=True)
+        names = [t.decode("ascii", "replace") for t in types]
+        for name, count in zip(names, typeCounts):
+            self.types[name] += int(count)
+        talkerNames = [talkerOf(t).decode("ascii", "replace") for t in types]
+        for talker, count in zip(talkerNames, typeCounts):
+            self.talkers[talker] += int(count)
+        timed = ~numpy.isnan(filled)
+        if timed.any():
+            buckets = ((filled[timed] - self.firstTs) // self.bucket).astype(numpy.int64)
+            for t in numpy.unique(typeIdx[timed]):
+                rates = self.rates[talkerNames[t]]
+                sel = typeIdx[timed] == t
+                b, c = numpy.unique(buckets[sel], return_counts=True)
+                for bucket, count in zip(b, c):
+                    rates[int(bucket)] += int(count)
+
+        # Checksums: XOR of the bytes between the marker and the last '*'
+        stars = numpy.flatnonzero(arr == 42)
+        if len(stars) == 0:
+            self.checksumMissing += len(mark)
+            return
+        last = numpy.searchsorted(stars, ends) - 1
+        star = stars[numpy.maximum(last, 0)]
+        hasSum = (last >= 0) & (star > mark) & (star + 2 < ends)
+        self.checksumMissing += int(len(mark) - hasSum.sum())
+        if not hasSum.any():
+            return
+        m, s = mark[hasSum] + 1, star[hasSum]
+        idx = numpy.empty(2 * len(m), dtype=numpy.int64)
+        idx[0::2] = m
+        idx[1::2] = s
+        computed = numpy.bitwise_xor.reduceat(arr, idx)[0::2]
+        computed[m == s] = 0
+        hexDigits = numpy.array(HEX_VALUES, dtype=numpy.int16)
+        hi = hexDigits[arr[s + 1]]
+        lo = hexDigits[arr[s + 2]]
+        bad = (hi < 0) | (lo < 0) | (hi * 16 + lo != computed)
+        self.checksumOk += int(len(m) - bad.sum())
+        for i in numpy.flatnonzero(bad):
+            self._addBad(names[typeIdx[hasSum][i]], int(lineno[hasSum][i]))
+    # End _addChunkNumpy()
+
+    def report(self, fName):
+        """Return the analysis as a JSON serialisable dictionary"""
+        span = None
+        rates = None
+        if self.firstTs is not None:
+            span = self.lastTs - self.firstTs
+            nBuckets = int(max(span, 0) // self.bucket) + 1
+            rates = {'bucket': self.bucket,
+                     'start': self.firstTs,
+                     'talkers': {}}
+            for talker, counts in sorted(self.rates.items()):
+                rates['talkers'][talker] = [counts.get(i, 0)
+                                            for i in range(nBuckets)]
+        replay = {'timing': 'nmea4' if self.timestamped else 'delay'}
+        if self.timestamped:
+            replay['gap'] = 'skip' if self.gapCount else 'real'
+            replay['gap-threshold'] = self.threshold
+        return {
+            'file': fName,
+            'bytes': self.bytes,
+            'lines': self.lines,
+            'sentences': self.sentences,
+            'types': dict(self.types.most_common()),
+            'talkers': dict(self.talkers.most_common()),
+            'checksums': {
+                'ok': self.checksumOk,
+                'bad': sum(self.badChecksums.values()),
+                'missing': self.checksumMissing,
+                'bad_by_type': dict(self.badChecksums.most_common()),
+                'bad_lines': self.badLines,
+            },
+            'timestamps': {
+                'count': self.timestamped,
+                'coverage': round(self.timestamped / self.sentences, 4)
+                if self.sentences else 0.0,
+                'first': self.firstTs,
+                'last': self.lastTs,
+                'span': span,
+                'backwards': self.backwards,
+            },
+            'gaps': {
+                'threshold': self.threshold,
+                'count': self.gapCount,
+                'total': round(self.gapTotal, 3),
+                'longest': round(self.gapLongest, 3),
+                'list': self.gaps,
+            },
+            'rates': rates,
+            'replay': replay,
+        }
+    # End report()
+# End RecordingAnalysis
+
+
+def analyzeFile(fName, threshold=60.0, bucket=60.0, chunkSize=ANALYZE_CHUNK_SIZE):
+    analysis = RecordingAnalysis(bucket, threshold)
+    with open(fName, 'rb') as f:
+        while True:
+            data = f.read(chunkSize)
+            if not data:
+                break
+            analysis.feed(data)
+    analysis.finish()
+    return analysis.report(fName)
+# End analyzeFile()
+
+
+# Options an --analyze report supplies in its replay section.  Its timing
+# entry ('nmea4' or 'delay') only describes the recording and is not an
+# option.
+REPORT_OPTIONS = ('gap', 'gap-threshold')
+
+
+# Read the replay section of an --analyze report as option defaults
+def loadReport(fName):
+    with open(fName, 'r') as f:
+        replay = json.load(f).get('replay', {})
+    return dict((key, value) for key, value in replay.items()
+                if key in REPORT_OPTIONS)
+
+
 def usage():
     print("USAGE:")
     print("[python3] VDRplayer.py [--port=Port#] [--sleep=Sleep time] "
@@ -469,7 +4022,158 @@ def usage():
     print("-s, --sleep=#.#        optional seconds delay between packets, when there is no timestamp in NMEA packets (NMEAv4).")
     print("                       default is 0.1 seconds.\n")
     print("-f, --fast=#.#         optional speed acceleration factor if NMEAv4.")
-    print("                       default factor is 1.\n")
+    print("                       must be above 0; default factor is 1.\n")
+    print("--gap=POLICY           how NMEAv4 timestamp gaps are replayed:")
+    print("                       skip    - send the next message at once"
+          " (default)")
+    print("                       clamp   - wait --gap-threshold seconds")
+    print("                       speed:F - replay gaps F times faster")
+    print("                       real    - replay gaps in full.\n")
+    print("--gap-threshold=#.#    recording seconds between timestamps that"
+          " count as a gap.")
+    print("                       default is 60 seconds.\n")
+    print("--control=[host:]port  accept playback commands on a local TCP"
+          " port:")
+    print("                       pause, resume, seek TIME, speed FACTOR,"
+          " status.")
+    print("                       TIME is seconds or H:MM:SS from the start"
+          " of the")
+    print("                       recording, or @UNIX-seconds.\n")
+    print("--multicast=Group_IP   send UDP to a multicast group instead of"
+          " --dest.")
+    print("                       One send reaches every subscribed"
+          " receiver.\n")
+    print("--ttl=#                multicast time to live (router hops)."
+          " Default is 1.\n")
+    print("--mcast-if=IP_Address  local interface to send multicast from.\n")
+    print("--mcast-loop=on|off    deliver multicast to receivers on this"
+          " computer.")
+    print("                       Default is on.\n")
+    print("--tcp-nodelay=on|off   send each tick to TCP clients at once"
+          " (TCP_NODELAY).")
+    print("                       Default is on.\n")
+    print("--tcp-cork             hold back partial TCP segments until a"
+          " tick is")
+    print("                       fully written (TCP_CORK, Linux only).\n")
+    print("--subscribe=TYPE,...   sentences sent to TCP clients that have"
+          " not sent")
+    print("                       their own \"subscribe TYPE,...\" line,"
+          " e.g. RMC,HDG")
+    print("                       or AIVDM.  Default is all sentences.\n")
+    print("--listen=Port:TYPE,... also accept TCP clients on Port and send"
+          " them only")
+    print("                       these sentences.  May be given more than"
+          " once.\n")
+    print("--serial=Device|pty    write to a serial device, or a new"
+          " pseudo-terminal")
+    print("                       whose name is printed, paced at the baud"
+          " rate.\n")
+    print("--baud=#               serial baud rate. Default is 4800.\n")
+    print("--serial-buffer=#      bytes that may wait for the serial link."
+          " Default is")
+    print("                       1024.\n")
+    print("--shm=Name             publish to a shared memory ring for"
+          " readers on this")
+    print("                       computer, see RingReader. Name without a"
+          " directory is")
+    print("                       created in /dev/shm. Default is vdr.\n")
+    print("--shm-size=#           bytes in the shared memory ring."
+          " Default is 1048576.\n")
+    print("--output=FILE          write the replay to FILE (- for stdout) as"
+          " fast as it")
+    print("                       can be read instead of sending it, each"
+          " sentence with a")
+    print("                       tag block giving the time it would have"
+          " been sent.")
+    print("                       --fast, --gap, --sleep, --mmsi, --bbox and"
+          " --subscribe")
+    print("                       apply.\n")
+    print("--retime=now|today|TIME")
+    print("                       start the --output recording now, on the"
+          " same time of day")
+    print("                       today, or at TIME (ISO 8601, HH:MM:SS today"
+          " or UNIX")
+    print("                       seconds). Default is its original"
+          " time.\n")
+    print("--checkpoint=FILE      save the position every 10 seconds and"
+          " when playback")
+    print("                       stops early, so that it can be resumed."
+          " The file is")
+    print("                       removed when playback completes.\n")
+    print("--resume=FILE          continue from a --checkpoint file, on the"
+          " same timeline:")
+    print("                       messages that fell due while VDRplayer"
+          " was stopped are")
+    print("                       skipped. The checkpoint is kept up to"
+          " date.\n")
+    print("--start-at=TIME        wait until TIME (ISO 8601, HH:MM:SS today"
+          " or UNIX")
+    print("                       seconds) and start the timeline there, to"
+          " keep separately")
+    print("                       started players in step.\n")
+    print("--partition=I/N        play only part I of N of the messages."
+          " Fragments of")
+    print("                       an AIS message stay together.\n")
+    print("--worker=[host:]port   wait on port for a coordinator and play"
+          " its jobs. The")
+    print("                       host defaults to 127.0.0.1; others need"
+          " --secret-file.\n")
+    print("--worker-dir=DIR       directory a worker plays files from."
+          " Default is the")
+    print("                       current directory.\n")
+    print("--secret-file=FILE     secret shared by a coordinator and workers"
+          " on other")
+    print("                       computers.\n")
+    print("--coordinate=host:port,...")
+    print("                       play on these workers: one InputFile is"
+          " split between")
+    print("                       them, several are dealt out in turn. Files"
+          " must be at the")
+    print("                       same path on every worker.\n")
+    print("--max-rate=#.#         send at most this many sentences a"
+          " second.\n")
+    print("--max-bytes=#.#        send at most this many bytes a second.\n")
+    print("--burst=#.#            seconds' worth of --max-rate or --max-bytes"
+          " that may")
+    print("                       be sent at once after a quiet period."
+          " Default is 1.0.\n")
+    print("--overflow=queue|drop  what happens to sentences over the rate"
+          " limit or when")
+    print("                       the serial buffer is full: queue them,"
+          " falling behind")
+    print("                       the recording, or drop them.  Default is"
+          " queue.\n")
+    print("--format=auto|nmea|timed|csv|clock")
+    print("                       input format. nmea is one sentence a line,"
+          " timed has")
+    print("                       a time before each sentence, csv is an"
+          " OpenCPN VDR")
+    print("                       CSV export and clock times plain NMEA by"
+          " its RMC,")
+    print("                       GGA and ZDA sentences.  Default is to"
+          " detect it.\n")
+    print("--follow               keep reading InputFile as another program"
+          " writes to")
+    print("                       it, following rotation and truncation,"
+          " until Ctrl-C.\n")
+    print("--tail                 like --follow, but only send lines written"
+          " after")
+    print("                       VDRplayer started.\n")
+    print("--mmsi=#,#,...         only play AIS messages from these MMSIs."
+          " Other")
+    print("                       sentences are still played.\n")
+    print("--bbox=minLat,minLon,maxLat,maxLon")
+    print("                       only play AIS messages from vessels"
+          " inside this")
+    print("                       box, in decimal degrees.\n")
+    print("--analyze              print a JSON report of the sentence types,"
+          " talker")
+    print("                       rates, timestamps, gaps and bad checksums"
+          " in InputFile")
+    print("                       instead of playing it.\n")
+    print("--report=FILE          take --gap and --gap-threshold defaults from"
+          " the replay")
+    print("                       section of an --analyze report.\n")
     print("-t, --TCP              create TCP server on primary IP address.")
     print("                       Specify local IP address using --host option"
           "\n                       to override default primary address.\n")
@@ -504,7 +4208,116 @@ def get_ip():
 # End get_pi()
 
 
-def main():
+# The --checkpoint file is a small JSON document: the input file, the byte
+# offset to read on from, the pass and the Scheduler.checkpoint() state.
+# It is replaced atomically so that a crash never leaves half of one.
+def saveCheckpoint(fName, state):
+    tmp = fName + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, fName)
+# End saveCheckpoint()
+
+
+def loadCheckpoint(fName):
+    try:
+        with open(fName) as f:
+            state = json.load(f)
+    except OSError as ex:
+        raise ValueError("Can not read checkpoint %s: %s" % (fName, ex))
+    except ValueError:
+        raise ValueError("%s is not a checkpoint file" % fName)
+    if not isinstance(state, dict) or \
+            state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError("%s is not a checkpoint file" % fName)
+    return state
+# End loadCheckpoint()
+
+
+# getopt specification of the command line
+SHORT_OPTIONS = 'd:ho:p:rs:utf:'
+LONG_OPTIONS = ['dest=',
+                'help',
+                'host=',
+                'port=',
+                'repeat=',
+                'sleep=',
+                'UDP',
+                'TCP',
+                'fast=',
+                'gap=',
+                'gap-threshold=',
+                'control=',
+                'analyze',
+                'report=',
+                'mmsi=',
+                'bbox=',
+                'multicast=',
+                'ttl=',
+                'mcast-if=',
+                'mcast-loop=',
+                'tcp-nodelay=',
+                'tcp-cork',
+                'subscribe=',
+                'listen=',
+                'serial=',
+                'baud=',
+                'serial-buffer=',
+                'overflow=',
+                'max-rate=',
+                'max-bytes=',
+                'burst=',
+                'follow',
+                'tail',
+                'format=',
+                'shm=',
+                'shm-size=',
+                'output=',
+                'retime=',
+                'checkpoint=',
+                'resume=',
+                'start-at=',
+                'partition=',
+                'worker=',
+                'coordinate=',
+                'worker-dir=',
+                'secret-file=']
+
+# The options a coordinator may hand on to its workers: the ones that
+# only choose how a recording is played, not which other files or
+# devices on the worker are read or written
+WORKER_OPTIONS = ('-d', '--dest', '-o', '--host', '-p', '--port', '-r',
+                  '--repeat', '-s', '--sleep', '-u', '--UDP', '-t', '--TCP',
+                  '-f', '--fast', '--gap', '--gap-threshold', '--mmsi',
+                  '--bbox', '--multicast', '--ttl', '--mcast-if',
+                  '--mcast-loop', '--tcp-nodelay', '--tcp-cork',
+                  '--subscribe', '--listen', '--max-rate', '--max-bytes',
+                  '--burst', '--overflow', '--follow', '--tail', '--format',
+                  '--partition')
+
+
+# "[host:]port" as (host, port), with host defaulting to defaultHost
+def parseAddress(text, defaultHost):
+    (host, _, port) = text.strip().rpartition(':')
+    port = int(port)
+    if not (1 <= port <= 65535):
+        raise ValueError("Port must be between 1 and 65535")
+    return (host or defaultHost, port)
+# End parseAddress()
+
+
+def isLoopback(host):
+    return host == 'localhost' or host == '::1' or host.startswith('127.')
+
+
+# Turn command line arguments into Player keyword arguments.
+# Returns None when help was requested and raises getopt.GetoptError
+# or ValueError for invalid options.  --worker and --coordinate return
+# the arguments of a Worker or Coordinator instead, with mode WORKER or
+# COORDINATE.
+def parseArgs(argv):
     # Set default options
     mode = 'UDP'
     Dest = None
@@ -512,89 +4325,325 @@ def main():
     IPport = None
     td = 0.1
     Repeat = 1
-    rCode = False
-    Speed=1
+    Speed = 1
+    gapMode = 'skip'
+    gapThreshold = 60.0
+    Control = None
+    mmsiSpec = None
+    bboxSpec = None
+    McastTTL = 1
+    McastIf = None
+    McastLoop = True
+    TcpNoDelay = True
+    TcpCork = False
+    Subscribe = None
+    Listen = []
+    Serial = 'pty'
+    Baud = 4800
+    SerialBuffer = 1024
+    Overflow = 'queue'
+    MaxRate = None
+    MaxBytes = None
+    Burst = 1.0
+    Follow = None
+    Format = 'auto'
+    Shm = 'vdr'
+    ShmSize = RING_SIZE
+    Output = None
+    Retime = None
+    Checkpoint = None
+    Resume = None
+    StartAt = None
+    part = None
+    worker = None
+    Workers = None
+    Root = None
+    Secret = None
+
+    # Pick up all commandline options
+    options, remainder = getopt.gnu_getopt(argv, SHORT_OPTIONS,
+                                           LONG_OPTIONS)
+    # A coordinator hands its other options on to the workers
+    forwarded = [opt if not arg else opt + '=' + arg if opt.startswith('--')
+                 else opt + arg for (opt, arg) in options
+                 if opt not in ('--coordinate', '--secret-file')]
+    refused = [opt for (opt, arg) in options if opt not in WORKER_OPTIONS
+               and opt not in ('--coordinate', '--secret-file')]
+    # Options from an --analyze report come first so that the command
+    # line can override them
+    for opt, arg in options:
+        if opt == '--report':
+            options = [('--' + key, str(value)) for key, value in
+                       loadReport(arg).items()] + options
+            break
+    # End for
+    for opt, arg in options:
+        if opt.lower() in ('-d', '--dest'):
+            mode = 'UDP'
+            Dest = arg
+        elif opt.lower() in ('-p', '--port'):
+            IPport = int(arg)
+            if not (1 <= IPport <= 65535):
+                raise ValueError("Port must be between 1 and 65535")
+        elif opt.lower() in ('-s', '--sleep'):
+            td = float(arg)
+        elif opt.lower() in ('-u', '--udp'):
+            mode = 'UDP'
+        elif opt.lower() in ('-t', '--tcp'):
+            mode = 'TCP'
+        elif opt in ('-o', '--host'):
+            mode = 'TCP'
+            Host = arg
+        elif opt in ('-f', '--fast'):
+            Speed = float(arg)
+            if Speed <= 0:
+                raise ValueError("Speed factor must be positive")
+        elif opt == '--gap':
+            gapMode = arg
+        elif opt == '--gap-threshold':
+            gapThreshold = float(arg)
+        elif opt == '--control':
+            (cHost, _, cPort) = arg.rpartition(':')
+            Control = (cHost or '127.0.0.1', int(cPort))
+        elif opt == '--analyze':
+            mode = 'ANALYZE'
+        elif opt == '--report':
+            pass
+        elif opt == '--multicast':
+            if not isMulticast(arg):
+                raise ValueError("'%s' is not a multicast group "
+                                 "(224.0.0.0 to 239.255.255.255)" % arg)
+            mode = 'UDP'
+            Dest = arg
+        elif opt == '--ttl':
+            McastTTL = int(arg)
+            if not (0 <= McastTTL <= 255):
+                raise ValueError("TTL must be between 0 and 255")
+        elif opt == '--mcast-if':
+            McastIf = arg
+        elif opt == '--mcast-loop':
+            McastLoop = arg.lower() not in ('0', 'off', 'no', 'false')
+        elif opt == '--tcp-nodelay':
+            TcpNoDelay = arg.lower() not in ('0', 'off', 'no', 'false')
+        elif opt == '--tcp-cork':
+            TcpCork = True
+        elif opt == '--subscribe':
+            mode = 'TCP'
+            Subscribe = parseSubscription(arg)
+        elif opt == '--listen':
+            mode = 'TCP'
+            (lPort, _, spec) = arg.partition(':')
+            lPort = int(lPort)
+            if not (1 <= lPort <= 65535):
+                raise ValueError("Port must be between 1 and 65535")
+            Listen.append((lPort, parseSubscription(spec or '*')))
+        elif opt == '--serial':
+            mode = 'SERIAL'
+            Serial = arg
+        elif opt == '--baud':
+            Baud = int(arg)
+            if Baud <= 0:
+                raise ValueError("Baud rate must be positive")
+        elif opt == '--serial-buffer':
+            SerialBuffer = int(arg)
+        elif opt == '--overflow':
+            if arg not in ('queue', 'drop'):
+                raise ValueError("Overflow policy must be queue or drop")
+            Overflow = arg
+        elif opt == '--max-rate':
+            MaxRate = float(arg)
+        elif opt == '--max-bytes':
+            MaxBytes = float(arg)
+        elif opt == '--burst':
+            Burst = float(arg)
+        elif opt == '--follow':
+            Follow = Follow or 'start'
+        elif opt == '--tail':
+            Follow = 'end'
+        elif opt == '--format':
+            if arg != 'auto' and arg not in DECODERS:
+                raise ValueError("Input format must be auto or one of: " +
+                                 ", ".join(DECODERS))
+            Format = arg
+        elif opt == '--shm':
+            mode = 'SHM'
+            Shm = arg
+        elif opt == '--shm-size':
+            ShmSize = int(arg)
+            if ShmSize < 4096:
+                raise ValueError("Ring size must be at least 4096 bytes")
+        elif opt == '--output':
+            Output = arg
+        elif opt == '--retime':
+            if arg in ('now', 'today'):
+                Retime = arg
+            else:
+                Retime = parseTime(arg)
+                if Retime < 86400:  # A time of day, today
+                    Retime += time.time() // 86400 * 86400
+        elif opt == '--checkpoint':
+            Checkpoint = arg
+        elif opt == '--resume':
+            Resume = arg
+        elif opt == '--start-at':
+            StartAt = parseTime(arg)
+            if StartAt < 86400:     # A time of day, today
+                StartAt += time.time() // 86400 * 86400
+        elif opt == '--partition':
+            (number, _, parts) = arg.partition('/')
+            part = (int(number), int(parts or 0))
+            Partition(*part)    # Check it
+        elif opt == '--worker':
+            worker = parseAddress(arg, '127.0.0.1')
+        elif opt == '--worker-dir':
+            if not os.path.isdir(arg):
+                raise ValueError("%s is not a directory" % arg)
+            Root = arg
+        elif opt == '--secret-file':
+            with open(arg, 'rb') as f:
+                Secret = f.read().strip()
+            if not Secret:
+                raise ValueError("Secret file %s is empty" % arg)
+        elif opt == '--coordinate':
+            Workers = [parseAddress(address, '127.0.0.1')
+                       for address in arg.split(',')]
+            if len(set(Workers)) < len(Workers):
+                raise ValueError("A worker is listed more than once")
+        elif opt == '--mmsi':
+            mmsiSpec = arg
+        elif opt == '--bbox':
+            bboxSpec = arg
+        elif opt in ('-r', '--repeat'):
+            if len(arg) > 0:
+                Repeat = int(arg)
+        elif opt.lower() in ('-h', '--help'):
+            return None
+        else:
+            raise getopt.GetoptError("Unknown option: " + opt)
+        # End if
+    # End for
+    if worker is not None:
+        if remainder or Workers:
+            raise getopt.GetoptError("A worker takes its files from the "
+                                     "coordinator")
+        if Secret is None and not isLoopback(worker[0]):
+            raise getopt.GetoptError("A worker listening beyond this "
+                                     "computer needs --secret-file")
+        return dict(mode='WORKER', Host=worker[0], Port=worker[1],
+                    Root=Root, Secret=Secret)
+    # End if
+    if len(remainder) < 1:
+        raise getopt.GetoptError("Please specify one file name containing "
+                                 "NMEA data.")
+    # End if
+    if Workers:
+        if refused:
+            raise getopt.GetoptError("%s can not be passed on to workers" %
+                                     ", ".join(refused))
+        if part is not None:
+            raise getopt.GetoptError("The coordinator chooses the "
+                                     "--partition of each worker")
+        return dict(mode='COORDINATE', Workers=Workers, fNames=remainder,
+                    Args=forwarded, Secret=Secret)
+    # End if
+    if Resume and StartAt is not None:
+        raise getopt.GetoptError("--start-at can not be used with --resume")
+    # End if
+    if Follow and (mmsiSpec or bboxSpec):
+        raise getopt.GetoptError("--mmsi and --bbox can not be used with "
+                                 "--follow or --tail")
+    # End if
+    if Output is not None:
+        if Follow:
+            raise getopt.GetoptError("--output can not be used with "
+                                     "--follow or --tail")
+        mode = 'FILE'   # --subscribe then filters the output
+    elif Retime is not None:
+        raise getopt.GetoptError("--retime needs --output")
+    # End if
+    if (Checkpoint or Resume) and (Follow or Output is not None):
+        raise getopt.GetoptError("--checkpoint and --resume can not be used "
+                                 "with --follow, --tail or --output")
+    # End if
+    if (Host is None) & (mode == 'TCP'):
+        Host = get_ip()
+    # End if
+    return dict(fName=remainder[0], mode=mode, Dest=Dest, Host=Host,
+                Port=IPport, Delay=td, Repeat=Repeat, Speed=Speed,
+                Gap=GapPolicy.parse(gapMode, gapThreshold), Control=Control,
+                Ais=AisFilter.parse(mmsiSpec, bboxSpec)
+                if mmsiSpec or bboxSpec else None,
+                McastTTL=McastTTL, McastIf=McastIf, McastLoop=McastLoop,
+                TcpNoDelay=TcpNoDelay, TcpCork=TcpCork, Subscribe=Subscribe,
+                Listen=Listen, Serial=Serial, Baud=Baud,
+                SerialBuffer=SerialBuffer, Overflow=Overflow, MaxRate=MaxRate,
+                MaxBytes=MaxBytes, Burst=Burst, Follow=Follow, Format=Format,
+                Shm=Shm, ShmSize=ShmSize, Output=Output, Retime=Retime,
+                Checkpoint=Checkpoint, Resume=Resume, StartAt=StartAt,
+                Partition=part)
+# End parseArgs()
 
-    # Activate cross-platform sleep prevention
-    keep_alive.prevent_sleep()
 
+def main():
+    rCode = False
     try:
-        # Pick up all commandline options
-        try:
-            options, remainder = getopt.gnu_getopt(sys.argv[1:], 'd:ho:p:rs:utf:',
-                                                   ['dest=',
-                                                    'help',
-                                                    'host=',
-                                                    'port=',
-                                                    'repeat=',
-                                                    'sleep=',
-                                                    'UDP',
-                                                    'TCP',
-                                                    'fast='])
-            for opt, arg in options:
-                if opt.lower() in ('-d', '--dest'):
-                    mode = 'UDP'
-                    Dest = arg
-                elif opt.lower() in ('-p', '--port'):
-                    IPport = int(arg)
-                    if not (1 <= IPport <= 65535):
-                        print("Error: Port must be between 1 and 65535")
-                        sys.exit(2)
-                elif opt.lower() in ('-s', '--sleep'):
-                    td = float(arg)
-                elif opt.lower() in ('-u', '--udp'):
-                    mode = 'UDP'
-                elif opt.lower() in ('-t', '--tcp'):
-                    mode = 'TCP'
-                elif opt in ('-o', '--host'):
-                    mode = 'TCP'
-                    Host = arg
-                elif opt in ('-f', '--fast'):
-                    Speed = float(arg)
-                elif opt in ('-r', '--repeat'):
-                    if len(arg) > 0:
-                        Repeat = int(arg)
-                elif opt.lower() in ('-h', '--help'):
-                    usage()
-                    sys.exit()
-                else:
-                    print("Unknown option: ", opt)
-                    usage()
-                    sys.exit(2)
-                # End if
-            # End for
-            if len(remainder) < 1:
-                print("Please specify one file name containing NMEA data.")
-                usage()
-                sys.exit(1)
-            # End if
-            if len(remainder) == 0:
-                fName = []
-            else:
-                fName = remainder[0]
-            if (Host is None) & (mode == 'TCP'):
-                Host = get_ip()
+        options = parseArgs(sys.argv[1:])
+    except getopt.GetoptError as msg:
+        print(msg)
+        usage()
+        sys.exit(2)
+    except ValueError as msg:
+        print("Error: %s" % msg)
+        sys.exit(2)
+    # End try
+    if options is None:
+        usage()
+        sys.exit()
+    # End if
 
-            # End if
-        except getopt.GetoptError as msg:
+    if options['mode'] == 'ANALYZE':
+        try:
+            report = analyzeFile(options['fName'], options['Gap'].threshold)
+        except OSError as msg:
             print(msg)
-            usage()
-            sys.exit(2)
+            sys.exit(1)
         # End try
+        print(json.dumps(report, indent=2))
+        sys.exit(0)
+    # End if
+
+    if options['mode'] == 'FILE':
+        if options['Output'] == '-':
+            # The recording goes to stdout, so messages go to stderr
+            options['Output'] = sys.stdout.buffer
+            sys.stdout = sys.stderr
+    else:
+        # Activate cross-platform sleep prevention
+        keep_alive.prevent_sleep()
 
+    try:
         # Main program
-        if mode.upper() == 'UDP':
-            rCode = udp(Dest, IPport, fName, td, Repeat, Speed)
-        elif mode.upper() == 'TCP':
-            rCode = tcp(Host, IPport, fName, td, Repeat, Speed)
-        else:
-            usage()
-        # End if
-        
+        try:
+            if options['mode'] == 'WORKER':
+                rCode = Worker(options['Host'], options['Port'],
+                               options['Root'], options['Secret']).serve()
+            elif options['mode'] == 'COORDINATE':
+                rCode = Coordinator(options['Workers'], options['fNames'],
+                                    options['Args'], options['Secret']).run()
+            else:
+                player = Player(**options)
+                player.launched = processStart()
+                rCode = player.run()
+        except KeyboardInterrupt:
+            print("\nKeyboardInterrupt.")
+            rCode = True
+        except OSError as msg:
+            print(msg)
+        # End try
     finally:
         # Always restore sleep capability when exiting
         keep_alive.allow_sleep()
-        
+
     if rCode is True:
         print("Exiting cleanly.")
         sys.exit(0)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Loopback benchmarks for the VDRplayer TCP server.
+
+The default benchmark plays a generated recording to many TCP clients on
+127.0.0.1.  The clients are spread over a few reader processes so that
+the server, not the readers, is measured.  Every client must receive
+every sentence it subscribed to; the throughput delivered and any short
+clients are printed.
+
+--ticks instead times Subscriptions.ticks() alone, for many subscription
+groups, which shows the cost per tick of filtering a batch.
+
+USAGE:
+    python3 tools/tcpbench.py [--clients=1000] [--sentences=20000]
+                              [--port=12950] [--readers=4] [--groups=1]
+    python3 tools/tcpbench.py --ticks [--groups=1000] [--sentences=1024]
+"""
+
+import sys
+import os
+import time
+import getopt
+import socket
+import selectors
+import multiprocessing
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import VDRplayer  # noqa: E402
+
+SENTENCES = (b'$GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,'
+             b'003.1,W*6A',
+             b'$HEHDG,238.5,,,,*7E',
+             b'!AIVDM,1,1,,A,13aEOK?P00PD2wVMdLDRhgvL289?,0*26',
+             b'$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,'
+             b'46.9,M,,*47')
+LEAD_IN = 5     # Seconds for the clients to connect
+IDLE = 30       # Seconds without data before a reader gives up
+# Subscription of each group, in turn; the first group takes everything
+GROUPS = ('*', 'RMC', 'HDG', 'AIVDM', 'GGA', 'RMC,HDG', 'AIVDM,GGA')
+
+
+def writeRecording(fName, count):
+    """All sentences but the first are due at once, LEAD_IN seconds
+    later, so that the clients can connect and the replay then runs as
+    fast as the server can send"""
+    with open(fName, 'wb') as f:
+        for i in range(count + 1):
+            ts = 1000000000 if i == 0 else 1000000000 + LEAD_IN
+            f.write(VDRplayer.tagMessage(SENTENCES[i % len(SENTENCES)] +
+                                         b'\r\n', ts))
+# End writeRecording()
+
+
+def expected(fName, spec, lines=None):
+    """Bytes a client subscribed to spec receives from the first lines"""
+    patterns = VDRplayer.parseSubscription(spec)
+    total = 0
+    with open(fName, 'rb') as f:
+        for line in itertools.islice(f, lines):
+            mess = line.rstrip(b'\r\n') + b'\r\n'
+            if VDRplayer.isSubscribed(patterns,
+                                      VDRplayer.messageAddress(mess)):
+                total += len(mess)
+    return total
+# End expected()
+
+
+def reader(port, specs, totals, leads, leadLine, queue):
+    socks = []
+    for spec in specs:
+        sock = socket.create_connection(('127.0.0.1', port))
+        if spec != '*':
+            sock.sendall(b'subscribe ' + spec.encode('ascii') + b'\n')
+        sock.setblocking(False)
+        socks.append(sock)
+    sel = selectors.DefaultSelector()
+    got = {}
+    want = {}
+    lead = {}
+    for (sock, spec) in zip(socks, specs):
+        sel.register(sock, selectors.EVENT_READ)
+        got[sock] = 0
+        want[sock] = totals[spec]
+        lead[sock] = leads[spec]
+    queue.put(('connected', len(socks)))
+    (first, last, remaining) = (None, None, len(socks))
+    while remaining:
+        events = sel.select(IDLE)
+        if not events:
+            break
+        for (key, mask) in events:
+            sock = key.fileobj
+            data = sock.recv(1 << 20)
+            last = time.time()
+            if data != leadLine:
+                if got[sock] == 0:
+                    want[sock] -= lead[sock]   # Connected after the lead in
+                if first is None:
+                    first = last
+            got[sock] += len(data)
+            if not data or got[sock] >= want[sock]:
+                sel.unregister(sock)
+                remaining -= 1
+    # End while
+    short = sum(1 for sock in socks if got[sock] < want[sock])
+    queue.put(('done', first, last, sum(got.values()), short))
+# End reader()
+
+
+def loopback(clients, sentences, port, readers, groups):
+    fName = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'tcpbench_%d.txt' % sentences)
+    VDRplayer.raiseFileLimit()
+    writeRecording(fName, sentences)
+    specs = [GROUPS[i % min(groups, len(GROUPS))] for i in range(clients)]
+    totals = {spec: expected(fName, spec) for spec in set(specs)}
+    leads = {spec: expected(fName, spec, 1) for spec in set(specs)}
+    with open(fName, 'rb') as f:
+        leadLine = f.readline()
+    player = VDRplayer.Player(fName, 'TCP', Host='127.0.0.1', Port=port,
+                              Delay=0.001, Gap=VDRplayer.GapPolicy('real'),
+                              on_log=lambda message: None)
+    player.start()
+    time.sleep(0.3)
+    queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=reader, args=(
+        port, specs[i::readers], totals, leads, leadLine, queue)) for i in range(readers)]
+    for proc in procs:
+        proc.start()
+    results = [queue.get() for _ in range(2 * readers)]
+    done = [r for r in results if r[0] == 'done']
+    start = min(r[1] for r in done if r[1] is not None)
+    end = max(r[2] for r in done if r[2] is not None)
+    total = sum(r[3] for r in done)
+    print("%d clients in %d groups, %d sentences: %.2f s, %.0f MB/s "
+          "delivered, %d short" % (clients, len(totals), sentences,
+                                   end - start, total / (end - start) / 1e6,
+                                   sum(r[4] for r in done)))
+    player.stop()
+    player.join(5)
+    for proc in procs:
+        proc.join()
+    os.remove(fName)
+# End loopback()
+
+
+def ticks(groups, sentences):
+    subs = VDRplayer.Subscriptions()
+    addresses = ['RMC', 'HDG', 'AIVDM', 'GGA', 'VTG', 'GSV', 'ZDA', 'MWV']
+    for i in range(groups):
+        # Every group has its own pattern set, all matching something
+        client = VDRplayer.TcpClient(None, ('127.0.0.1', i),
+                                     patterns=VDRplayer.parseSubscription(
+            '%s,X%d' % (addresses[i % len(addresses)], i)))
+        subs.add(client)
+    batch = [SENTENCES[i % len(SENTENCES)] + b'\r\n'
+             for i in range(sentences)]
+    rounds = 20
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for (buf, clients) in subs.ticks(batch):
+            pass
+    took = (time.perf_counter() - started) / rounds
+    print("%d groups, %d sentence tick: %.2f ms per tick" %
+          (groups, sentences, took * 1000))
+# End ticks()
+
+
+def main():
+    (clients, sentences, port, readers, groups) = (1000, 20000, 12950, 4, 1)
+    tickMode = False
+    try:
+        options, remainder = getopt.gnu_getopt(
+            sys.argv[1:], 'h', ['clients=', 'sentences=', 'port=',
+                                'readers=', 'groups=', 'ticks', 'help'])
+    except getopt.GetoptError as msg:
+        print(msg)
+        print(__doc__)
+        sys.exit(2)
+    for opt, arg in options:
+        if opt == '--clients':
+            clients = int(arg)
+        elif opt == '--sentences':
+            sentences = int(arg)
+        elif opt == '--port':
+            port = int(arg)
+        elif opt == '--readers':
+            readers = int(arg)
+        elif opt == '--groups':
+            groups = int(arg)
+        elif opt == '--ticks':
+            tickMode = True
+        elif opt in ('-h', '--help'):
+            print(__doc__)
+            sys.exit()
+    # End for
+    if tickMode:
+        ticks(groups, sentences)
+    else:
+        loopback(clients, sentences, port, readers, groups)
+# End main()
+
+
+if __name__ == '__main__':
+    main()